@@ -0,0 +1,129 @@
+import threading
+import time
+
+from django.core.cache import cache
+from django.db import transaction
+
+
+VERSION_KEY = 'data_version:{}'
+CARD_KEY = 'recipe_card:{}:{}'
+CARD_VERSION_KEY = 'recipe_card:version:{}'
+GENERATION_KEY = 'recipe_card:generation'
+HITS_KEY = 'recipe_card:hits'
+MISSES_KEY = 'recipe_card:misses'
+CARD_TIMEOUT = 60 * 60 * 24
+STATS_FLUSH_INTERVAL = 60
+
+
+def get_versions(*names):
+    """Версии наборов данных: время последнего изменения в наносекундах."""
+    keys = [VERSION_KEY.format(name) for name in names]
+    versions = cache.get_many(keys)
+    missing = {key: time.time_ns() for key in keys if key not in versions}
+    if missing:
+        cache.set_many(missing, None)
+        versions.update(missing)
+    return [versions[key] for key in keys]
+
+
+def bump_versions(*names):
+    now = time.time_ns()
+    cache.set_many({VERSION_KEY.format(name): now for name in names}, None)
+
+
+def bump_after_commit(*names):
+    transaction.on_commit(lambda: bump_versions(*names))
+
+
+class RecipeCardCache:
+    """Кэш не зависящей от пользователя части карточек рецептов.
+
+    Карточки хранятся по id и версии рецепта в версии-поколении:
+    изменение одного рецепта меняет его версию, изменение тэгов или
+    ингредиентов меняет поколение и тем самым сбрасывает все карточки.
+    Карточка, собранная до смены версии, записывается под старым
+    ключом и никем не читается.
+    Попадания и промахи копятся в процессе и записываются в кэш
+    не чаще раза в STATS_FLUSH_INTERVAL секунд.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.pending = {HITS_KEY: 0, MISSES_KEY: 0}
+        self.flushed_at = time.monotonic()
+
+    def get_generation(self):
+        return cache.get_or_set(GENERATION_KEY, time.time_ns, None)
+
+    def get_versions(self, recipe_ids):
+        """Версии карточек рецептов, недостающие создаются."""
+        keys = {CARD_VERSION_KEY.format(recipe_id): recipe_id
+                for recipe_id in recipe_ids}
+        versions = cache.get_many(keys)
+        for key in keys.keys() - versions.keys():
+            version = time.time_ns()
+            if not cache.add(key, version, None):
+                version = cache.get(key, version)
+            versions[key] = version
+        return {recipe_id: versions[key] for key, recipe_id in keys.items()}
+
+    def get_many(self, recipe_ids, generation=None):
+        """Карточки из кэша и версии, под которыми сохранять новые."""
+        versions = self.get_versions(recipe_ids)
+        keys = {CARD_KEY.format(recipe_id, version): recipe_id
+                for recipe_id, version in versions.items()}
+        found = cache.get_many(keys,
+                               version=generation or self.get_generation())
+        self.record(hits=len(found), misses=len(keys) - len(found))
+        return {keys[key]: card for key, card in found.items()}, versions
+
+    def set_many(self, cards, versions, generation=None):
+        if not cards:
+            return
+        cache.set_many(
+            {CARD_KEY.format(recipe_id, versions[recipe_id]): card
+             for recipe_id, card in cards.items()},
+            timeout=CARD_TIMEOUT,
+            version=generation or self.get_generation(),
+        )
+
+    def invalidate(self, recipe_ids):
+        now = time.time_ns()
+        cache.set_many({CARD_VERSION_KEY.format(recipe_id): now
+                        for recipe_id in recipe_ids}, None)
+
+    def invalidate_all(self):
+        cache.set(GENERATION_KEY, time.time_ns(), None)
+
+    def record(self, hits=0, misses=0):
+        with self.lock:
+            self.pending[HITS_KEY] += hits
+            self.pending[MISSES_KEY] += misses
+            if time.monotonic() - self.flushed_at < STATS_FLUSH_INTERVAL:
+                return
+        self.flush()
+
+    def flush(self):
+        with self.lock:
+            pending = self.pending
+            self.pending = dict.fromkeys(pending, 0)
+            self.flushed_at = time.monotonic()
+        for key, value in pending.items():
+            if not value:
+                continue
+            try:
+                cache.incr(key, value)
+            except ValueError:
+                cache.add(key, value, None)
+
+    def get_stats(self):
+        self.flush()
+        stats = cache.get_many((HITS_KEY, MISSES_KEY))
+        return {'hits': stats.get(HITS_KEY, 0),
+                'misses': stats.get(MISSES_KEY, 0)}
+
+    def reset_stats(self):
+        cache.delete_many((HITS_KEY, MISSES_KEY))
+
+
+recipe_cards = RecipeCardCache()
@@ -0,0 +1,133 @@
+import logging
+import sys
+import threading
+from bisect import bisect_left
+from collections import namedtuple
+from itertools import islice
+
+from rest_framework.renderers import JSONRenderer
+
+from recipe.models import Ingredient, Tag
+
+from .cache import get_versions
+from .serializers import IngredientSerializer, TagSerializer
+
+
+logger = logging.getLogger(__name__)
+
+Snapshot = namedtuple('Snapshot',
+                      ('version', 'data', 'content', 'size', 'index'),
+                      defaults=(None,))
+NameIndex = namedtuple('NameIndex', ('names', 'sorted_names', 'positions'))
+
+
+def get_deep_size(value):
+    size = sys.getsizeof(value)
+    if isinstance(value, dict):
+        size += sum(get_deep_size(key) + get_deep_size(item)
+                    for key, item in value.items())
+    elif isinstance(value, (list, tuple)):
+        size += sum(get_deep_size(item) for item in value)
+    return size
+
+
+class CatalogSnapshot:
+    """Снимок справочника в памяти процесса.
+
+    Хранит сериализованные записи и готовый JSON. Перед выдачей
+    сверяет версию набора данных и при расхождении перечитывает
+    справочник из базы.
+    """
+
+    def __init__(self, version_name, queryset, serializer_class):
+        self.version_name = version_name
+        self.queryset = queryset
+        self.serializer_class = serializer_class
+        self.snapshot = None
+        self.lock = threading.Lock()
+
+    def get(self, version=None):
+        """Актуальный снимок.
+
+        version - уже прочитанная версия набора данных, например
+        для ETag, чтобы не запрашивать ее из кэша повторно.
+        """
+        if version is None:
+            version, = get_versions(self.version_name)
+        snapshot = self.snapshot
+        if snapshot is not None and snapshot.version == version:
+            return snapshot
+        with self.lock:
+            if self.snapshot is None or self.snapshot.version != version:
+                self.snapshot = self.load(version)
+            return self.snapshot
+
+    def load(self, version):
+        data = tuple(
+            self.serializer_class(self.queryset.all(), many=True).data
+        )
+        content = JSONRenderer().render(data)
+        size = get_deep_size(data) + sys.getsizeof(content)
+        logger.info('Снимок %s версии %s: %d записей, %d байт',
+                    self.version_name, version, len(data), size)
+        return Snapshot(version, data, content, size)
+
+
+class IngredientCatalog(CatalogSnapshot):
+    """Снимок ингредиентов с индексом для автодополнения по названию.
+
+    Индекс - отсортированный массив названий в casefold с бинарным
+    поиском по префиксу. Совпадения по префиксу идут первыми,
+    за ними совпадения по вхождению.
+    """
+
+    def load(self, version):
+        snapshot = super().load(version)
+        names = [item['name'].casefold() for item in snapshot.data]
+        positions = sorted(range(len(names)), key=names.__getitem__)
+        index = NameIndex(names=names,
+                          sorted_names=[names[i] for i in positions],
+                          positions=positions)
+        size = snapshot.size + sum(map(get_deep_size, index))
+        return snapshot._replace(index=index, size=size)
+
+    def search(self, name, limit=None, version=None):
+        snapshot = self.get(version)
+        index = snapshot.index
+        needle = name.casefold()
+        start = bisect_left(index.sorted_names, needle)
+        prefixed = []
+        for position in range(start, len(index.sorted_names)):
+            if not index.sorted_names[position].startswith(needle):
+                break
+            prefixed.append(index.positions[position])
+        if limit is not None and len(prefixed) >= limit:
+            return [snapshot.data[position] for position in prefixed[:limit]]
+        found = set(prefixed)
+        contained = sorted(
+            (position for position, item in enumerate(index.names)
+             if needle in item and position not in found),
+            key=index.names.__getitem__,
+        )
+        matches = prefixed + contained
+        return [snapshot.data[position]
+                for position in islice(matches, limit)]
+
+
+class TagCatalog(CatalogSnapshot):
+    """Снимок тэгов с отображением slug в id для фильтрации рецептов."""
+
+    def load(self, version):
+        snapshot = super().load(version)
+        index = {item['slug']: item['id'] for item in snapshot.data}
+        return snapshot._replace(index=index,
+                                 size=snapshot.size + get_deep_size(index))
+
+    def get_ids_by_slug(self):
+        return self.get().index
+
+
+tag_catalog = TagCatalog('tags', Tag.objects.all(), TagSerializer)
+ingredient_catalog = IngredientCatalog('ingredients',
+                                       Ingredient.objects.all(),
+                                       IngredientSerializer)
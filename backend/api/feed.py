@@ -0,0 +1,33 @@
+from django.db.models import F
+
+from constants.constants import FEED_FANOUT_LIMIT
+from recipe.models import FeedEntry, Recipe
+from user.models import User
+
+
+def fan_out_recipe(recipe_id):
+    """Задача: разносит новый рецепт по лентам подписчиков.
+
+    Рецепты авторов с числом подписчиков от FEED_FANOUT_LIMIT не
+    разносятся, лента подтягивает их запросом при чтении.
+    """
+    followers = (Recipe.objects.filter(id=recipe_id)
+                 .values_list('author__followers_count', flat=True).first())
+    if followers is None or followers >= FEED_FANOUT_LIMIT:
+        return
+    FeedEntry.objects.fan_out(recipe_id)
+
+
+def get_feed_sources(user):
+    """Источники ленты: записи ленты и рецепты популярных авторов."""
+    pulled = (User.objects
+              .filter(author__user=user,
+                      followers_count__gte=FEED_FANOUT_LIMIT)
+              .values_list('id', flat=True))
+    sources = [FeedEntry.objects.filter(user=user)
+               .values('pub_date', 'recipe_id')]
+    pulled = list(pulled)
+    if pulled:
+        sources.append(Recipe.objects.filter(author_id__in=pulled)
+                       .values('pub_date', recipe_id=F('id')))
+    return sources
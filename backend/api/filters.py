@@ -1,8 +1,16 @@
+from django.db.models import Exists, OuterRef
 from django_filters import rest_framework
 
 from recipe.models import Ingredient, Recipe
 from user.models import User
 
+from .catalog import tag_catalog
+from .search import search_recipes
+
+
+def get_tag_choices():
+    return [(slug, slug) for slug in tag_catalog.get_ids_by_slug()]
+
 
 class IngedientNameFilter(rest_framework.FilterSet):
     name = rest_framework.CharFilter(lookup_expr='istartswith',
@@ -23,12 +31,14 @@ class RecipesFilters(rest_framework.FilterSet):
         method='get_favorite',
     )
 
-    tags = rest_framework.AllValuesMultipleFilter(
-        field_name='tags__slug',
+    tags = rest_framework.MultipleChoiceFilter(
+        choices=get_tag_choices,
+        method='get_tags',
     )
     is_in_shopping_cart = rest_framework.BooleanFilter(
         method='get_is_in_shopping_cart',
     )
+    search = rest_framework.CharFilter(method='get_search')
 
     class Meta:
         model = Recipe
@@ -37,6 +47,7 @@ class RecipesFilters(rest_framework.FilterSet):
             'author',
             'is_favorited',
             'is_in_shopping_cart',
+            'search',
         )
 
     def get_favorite(self, queryset, name, value):
@@ -44,7 +55,25 @@ class RecipesFilters(rest_framework.FilterSet):
             return queryset.filter(recipe_favorite__user=self.request.user.id)
         return queryset
 
+    def get_tags(self, queryset, name, value):
+        """Рецепты хотя бы с одним из тэгов, без join и DISTINCT.
+
+        Снимок тэгов мог обновиться после проверки choices, поэтому
+        тэги, которых в нем уже нет, пропускаются.
+        """
+        if not value:
+            return queryset
+        ids_by_slug = tag_catalog.get_ids_by_slug()
+        tag_ids = [ids_by_slug[slug] for slug in value if slug in ids_by_slug]
+        return queryset.filter(Exists(Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'),
+            tag_id__in=tag_ids,
+        )))
+
     def get_is_in_shopping_cart(self, queryset, name, value):
         if value:
             return queryset.filter(shoplist__user=self.request.user.id)
         return queryset
+
+    def get_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
@@ -0,0 +1,63 @@
+import io
+from pathlib import PurePath
+
+from django.core.files.base import ContentFile
+from PIL import Image, ImageOps
+
+from jobs.models import Job
+from recipe.models import Recipe
+
+from .cache import bump_versions
+
+
+IMAGE_VARIANTS = {
+    'image_card': (480, 360),
+    'image_detail': (1200, 900),
+}
+VARIANT_FORMAT = 'WEBP'
+VARIANT_EXTENSION = 'webp'
+VARIANT_QUALITY = 80
+
+
+def render_variant(image, size):
+    """Уменьшенная копия в WebP, пропорции сохраняются."""
+    variant = image.copy()
+    variant.thumbnail(size, Image.LANCZOS)
+    buffer = io.BytesIO()
+    variant.save(buffer, VARIANT_FORMAT, quality=VARIANT_QUALITY)
+    return ContentFile(buffer.getvalue())
+
+
+def make_variants(recipe_id):
+    """Создает варианты изображения рецепта.
+
+    Варианты сохраняются, только если изображение рецепта не сменилось
+    за время обработки, иначе созданные файлы удаляются.
+    """
+    recipe = Recipe.objects.filter(id=recipe_id).only('image').first()
+    if recipe is None or not recipe.image:
+        return
+    name = recipe.image.name
+    with recipe.image.open('rb') as file, Image.open(file) as original:
+        image = ImageOps.exif_transpose(original)
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGBA' if 'transparency' in image.info
+                                  else 'RGB')
+        variants = {field: render_variant(image, size)
+                    for field, size in IMAGE_VARIANTS.items()}
+    stem = PurePath(name).stem
+    for field, content in variants.items():
+        getattr(recipe, field).save(f'{stem}.{VARIANT_EXTENSION}', content,
+                                    save=False)
+    updated = Recipe.objects.filter(id=recipe_id, image=name).update(
+        **{field: getattr(recipe, field).name for field in variants})
+    if not updated:
+        for field in variants:
+            getattr(recipe, field).delete(save=False)
+        return
+    bump_versions('recipes')
+
+
+def schedule_variants(recipe_id):
+    """Ставит обработку изображения в очередь задач."""
+    Job.objects.enqueue('api.images.make_variants', recipe_id)
@@ -0,0 +1,63 @@
+import time
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.management.base import BaseCommand
+from django.db.models import prefetch_related_objects
+from rest_framework import serializers
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from api.serializers import RecipeGetListSerializer
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает скорость сборки карточек рецептов полями DRF '
+            'и build_card на рецептах из базы. Ничего не изменяет.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[6, 50, 500],
+                            help='Размеры страниц.')
+        parser.add_argument('--seconds', type=float, default=1.0,
+                            help='Сколько секунд замерять каждый вариант.')
+
+    def handle(self, *args, **options):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = AnonymousUser()
+        serializer = RecipeGetListSerializer(context={'request': request})
+        builders = {
+            'DRF fields': lambda recipe: (
+                serializers.ModelSerializer.to_representation(serializer,
+                                                              recipe)),
+            'build_card': lambda recipe: serializer.personalize(
+                serializer.build_card(recipe), recipe),
+        }
+        self.stdout.write('page size   ' + '   '.join(
+            f'{name:>12}' for name in builders))
+        for size in options['sizes']:
+            recipes = list(Recipe.objects.select_related('author')
+                           .defer('search_vector').order_by('-id')[:size])
+            if len(recipes) < size:
+                self.stderr.write(f'В базе только {len(recipes)} рецептов '
+                                  f'для страницы {size}')
+            prefetch_related_objects(recipes,
+                                     *RecipeGetListSerializer.card_prefetch)
+            rates = [self.measure(build, recipes, options['seconds'])
+                     for build in builders.values()]
+            self.stdout.write(f'{len(recipes):<9}   ' + '   '.join(
+                f'{rate:>10.0f}/s' for rate in rates))
+
+    def measure(self, build, recipes, seconds):
+        """Карточек в секунду при повторной сборке всей страницы."""
+        if not recipes:
+            return 0
+        built = 0
+        started = time.perf_counter()
+        while True:
+            for recipe in recipes:
+                build(recipe)
+            built += len(recipes)
+            elapsed = time.perf_counter() - started
+            if elapsed >= seconds:
+                return built / elapsed
@@ -0,0 +1,61 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from api.catalog import ingredient_catalog
+from api.serializers import IngredientSerializer
+from recipe.models import Ingredient
+
+
+def percentile(values, share):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * share))]
+
+
+class Command(BaseCommand):
+    help = ('Сравнивает задержки поиска ингредиентов по названию: '
+            'фильтр ORM istartswith и индекс в памяти. Ничего не изменяет.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--queries', type=int, default=300,
+                            help='Сколько запросов замерять.')
+        parser.add_argument('--limit', type=int, default=10,
+                            help='limit для варианта индекса с лимитом.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed выбора запросов.')
+
+    def handle(self, *args, **options):
+        names = list(Ingredient.objects.values_list('name', flat=True))
+        if not names:
+            self.stderr.write('В базе нет ингредиентов, загрузите их '
+                              'командой load_csv')
+            return
+        generator = random.Random(options['seed'])
+        queries = [
+            name[:generator.randint(1, 3)]
+            for name in generator.choices(names, k=options['queries'])
+        ]
+        ingredient_catalog.get()
+        limit = options['limit']
+        variants = {
+            'ORM filter': lambda query: IngredientSerializer(
+                Ingredient.objects.filter(name__istartswith=query),
+                many=True,
+            ).data,
+            'index': lambda query: ingredient_catalog.search(query),
+            f'index, limit={limit}': lambda query: (
+                ingredient_catalog.search(query, limit)),
+        }
+        self.stdout.write(f'{len(names)} ингредиентов, '
+                          f'{len(queries)} запросов')
+        self.stdout.write(f'{"":<18}{"p50":>10}{"p99":>10}')
+        for title, search in variants.items():
+            timings = []
+            for query in queries:
+                started = time.perf_counter()
+                search(query)
+                timings.append((time.perf_counter() - started) * 1000)
+            self.stdout.write(f'{title:<18}'
+                              f'{percentile(timings, 0.5):>7.2f} ms'
+                              f'{percentile(timings, 0.99):>7.2f} ms')
@@ -0,0 +1,85 @@
+import random
+import time
+import tracemalloc
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.shopping_list import EXPORT_FORMATS, get_shopping_list
+from recipe.models import (Ingredient,
+                           Recipe,
+                           RecipeToIngredient,
+                           ShopList,
+                           ShopListIngredient)
+from user.models import User
+
+
+class Command(BaseCommand):
+    help = ('Скорость и пиковая память выгрузки списка покупок во всех '
+            'форматах для корзин разного размера. Тестовые данные '
+            'создаются в транзакции и откатываются.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--sizes', type=int, nargs='+',
+                            default=[10, 100, 1000],
+                            help='Число рецептов в корзине.')
+        parser.add_argument('--ingredients', type=int, default=8,
+                            help='Ингредиентов в каждом рецепте.')
+        parser.add_argument('--seed', type=int, default=0,
+                            help='Seed выбора ингредиентов.')
+
+    def handle(self, *args, **options):
+        ingredient_ids = list(Ingredient.objects.values_list('id',
+                                                             flat=True))
+        if len(ingredient_ids) < options['ingredients']:
+            raise CommandError('Мало ингредиентов в базе, загрузите их '
+                               'командой load_csv')
+        generator = random.Random(options['seed'])
+        self.stdout.write(f'{"recipes":<9}{"format":<8}{"bytes":>10}'
+                          f'{"MB/s":>9}{"peak KiB":>11}')
+        with transaction.atomic():
+            for size in options['sizes']:
+                user = self.fill_cart(size, ingredient_ids,
+                                      options['ingredients'], generator)
+                for name, render in EXPORT_FORMATS.items():
+                    self.measure(size, name, render, user)
+            transaction.set_rollback(True)
+
+    def fill_cart(self, size, ingredient_ids, per_recipe, generator):
+        user = User.objects.create_user(
+            username=f'benchmark{size}',
+            email=f'benchmark{size}@example.com',
+            first_name='Benchmark',
+            last_name='Benchmark',
+        )
+        recipes = [
+            Recipe.objects.create(author=user, name=f'Рецепт {number}',
+                                  image='recipes/benchmark.png',
+                                  text='Описание', cooking_time=10)
+            for number in range(size)
+        ]
+        RecipeToIngredient.objects.bulk_create(
+            RecipeToIngredient(recipe=recipe, ingredient_id=ingredient_id,
+                               amount=generator.randint(1, 500))
+            for recipe in recipes
+            for ingredient_id in generator.sample(ingredient_ids,
+                                                  per_recipe)
+        )
+        recipe_ids = [recipe.id for recipe in recipes]
+        ShopList.objects.add_many(user.id, recipe_ids)
+        ShopListIngredient.objects.add_recipes(recipe_ids, user.id)
+        return user
+
+    def measure(self, size, name, render, user):
+        tracemalloc.start()
+        started = time.perf_counter()
+        length = sum(
+            len(chunk if isinstance(chunk, bytes) else chunk.encode())
+            for chunk in render(get_shopping_list(user))
+        )
+        elapsed = time.perf_counter() - started
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+        self.stdout.write(f'{size:<9}{name:<8}{length:>10}'
+                          f'{length / elapsed / 10 ** 6:>9.2f}'
+                          f'{peak / 1024:>11.0f}')
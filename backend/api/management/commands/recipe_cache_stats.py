@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+
+from api.cache import recipe_cards
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша карточек рецептов.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true',
+                            help='Обнулить счетчики после вывода.')
+
+    def handle(self, *args, **options):
+        stats = recipe_cards.get_stats()
+        total = stats['hits'] + stats['misses']
+        ratio = stats['hits'] / total if total else 0
+        self.stdout.write(f"hits: {stats['hits']}\n"
+                          f"misses: {stats['misses']}\n"
+                          f'hit ratio: {ratio:.2%}')
+        if options['reset']:
+            recipe_cards.reset_stats()
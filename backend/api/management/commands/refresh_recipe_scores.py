@@ -0,0 +1,40 @@
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db.models import Q
+from django.utils import timezone
+
+from api.cache import bump_versions
+from api.scores import get_active_recipes, refresh_scores
+from recipe.models import Recipe
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает рейтинги popular и trending для рецептов '
+            'с новыми добавлениями в избранное и списки покупок.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=120,
+                            help='Окно новых событий. Должно перекрывать '
+                                 'интервал запуска команды.')
+        parser.add_argument('--full', action='store_true',
+                            help='Пересчитать все рецепты, в том числе '
+                                 'после удалений из избранного.')
+        parser.add_argument('--batch-size', type=int, default=500)
+
+    def handle(self, *args, **options):
+        if options['full']:
+            recipe_ids = (Recipe.objects
+                          .filter(Q(recipe_favorite__isnull=False)
+                                  | Q(shoplist__isnull=False)
+                                  | Q(popularity_score__gt=0))
+                          .values_list('id', flat=True)
+                          .distinct()
+                          .order_by('id'))
+        else:
+            recipe_ids = get_active_recipes(
+                timezone.now() - timedelta(minutes=options['minutes']))
+        count = refresh_scores(recipe_ids, options['batch_size'])
+        if count:
+            bump_versions('recipes')
+        self.stdout.write(f'Изменено рейтингов: {count}')
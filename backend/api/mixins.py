@@ -0,0 +1,134 @@
+import hashlib
+import logging
+
+from django.conf import settings
+from django.db import connection
+from django.http import HttpResponse
+from django.utils.cache import get_conditional_response, patch_vary_headers
+from django.utils.http import http_date, quote_etag
+from rest_framework.response import Response
+
+from .cache import get_versions
+
+
+logger = logging.getLogger(__name__)
+
+
+class QueryBudgetExceeded(AssertionError):
+    pass
+
+
+class QueryBudgetMixin:
+    """Ограничение числа SQL-запросов на action вьюсета.
+
+    query_budget задает максимум запросов для action, включая
+    аутентификацию и все варианты фильтрации. Превышение пишется
+    в лог, а при QUERY_BUDGET_STRICT приводит к исключению.
+    """
+
+    query_budget = {}
+
+    def dispatch(self, request, *args, **kwargs):
+        queries = []
+
+        def count_query(execute, sql, params, many, context):
+            queries.append(sql)
+            return execute(sql, params, many, context)
+
+        with connection.execute_wrapper(count_query):
+            response = super().dispatch(request, *args, **kwargs)
+        self.check_query_budget(len(queries))
+        return response
+
+    def check_query_budget(self, count):
+        budget = self.query_budget.get(getattr(self, 'action', None))
+        if budget is None or count <= budget:
+            return
+        message = (f'{self.__class__.__name__}.{self.action}: '
+                   f'{count} SQL-запросов при лимите {budget}')
+        if getattr(settings, 'QUERY_BUDGET_STRICT', False):
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
+
+
+class ConditionalGetMixin:
+    """ETag и Last-Modified для list и retrieve по версиям данных.
+
+    Валидаторы считаются из версий наборов conditional_versions, пути
+    запроса и пользователя, поэтому ответ 304 отдается без обращения
+    к базе и сериализации. Для conditional_personalized ответы
+    различаются по пользователю.
+    """
+
+    conditional_versions = ()
+    conditional_personalized = False
+
+    def list(self, request, *args, **kwargs):
+        return self.conditional_response(super().list, request,
+                                         *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.conditional_response(super().retrieve, request,
+                                         *args, **kwargs)
+
+    def get_validators(self, request):
+        names = list(self.conditional_versions)
+        user_id = None
+        if self.conditional_personalized and request.user.is_authenticated:
+            user_id = request.user.id
+            names.append(f'user:{user_id}')
+        versions = get_versions(*names)
+        self.data_versions = dict(zip(names, versions))
+        key = repr((versions, user_id, request.build_absolute_uri(),
+                    request.META.get('HTTP_ACCEPT')))
+        etag = quote_etag(hashlib.md5(key.encode()).hexdigest())
+        return etag, max(versions) // 10 ** 9
+
+    def conditional_response(self, handler, request, *args, **kwargs):
+        etag, last_modified = self.get_validators(request)
+        response = get_conditional_response(request._request,
+                                            etag=etag,
+                                            last_modified=last_modified)
+        if response is None:
+            response = handler(request, *args, **kwargs)
+            if response.status_code != 200:
+                return response
+        response['ETag'] = etag
+        response['Last-Modified'] = http_date(last_modified)
+        if self.conditional_personalized:
+            patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class CatalogSnapshotMixin:
+    """list справочника из снимка в памяти процесса.
+
+    Запросы без параметров фильтрации отдаются из catalog_snapshot,
+    для JSON сразу готовыми байтами без рендеринга. Фильтрацию по
+    снимку задает search_catalog.
+    """
+
+    catalog_snapshot = None
+
+    def list(self, request, *args, **kwargs):
+        filterset_class = getattr(self, 'filterset_class', None)
+        filters = filterset_class.base_filters if filterset_class else ()
+        if any(request.query_params.get(name) for name in filters):
+            data = self.search_catalog(request)
+            if data is None:
+                return super().list(request, *args, **kwargs)
+            return Response(data)
+        snapshot = self.catalog_snapshot.get(self.get_catalog_version())
+        if request.accepted_renderer.format == 'json':
+            return HttpResponse(snapshot.content,
+                                content_type='application/json')
+        return Response(snapshot.data)
+
+    def get_catalog_version(self):
+        """Версия справочника, прочитанная ConditionalGetMixin, или None."""
+        return getattr(self, 'data_versions', {}).get(
+            self.catalog_snapshot.version_name)
+
+    def search_catalog(self, request):
+        """Отфильтрованный список из снимка или None для запроса к базе."""
+        return None
@@ -1,5 +1,164 @@
-from rest_framework.pagination import PageNumberPagination
+import base64
+import binascii
+import heapq
+import json
+from collections import OrderedDict
+
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import (BasePagination,
+                                       PageNumberPagination,
+                                       _positive_int)
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+from recipe.models import FeedEntry
+
+
+class KeysetPaginator(BasePagination):
+    """Keyset-пагинация с непрозрачным курсором.
+
+    Страница выбирается условием по ключу сортировки последней
+    записи предыдущей страницы, поэтому глубокие страницы не
+    требуют OFFSET, а общее количество не считается.
+    """
+
+    ordering = ('-pub_date', '-id')
+    cursor_query_param = 'cursor'
+    page_size_query_param = 'limit'
+    page_size = api_settings.PAGE_SIZE
+    invalid_cursor_message = 'Неверный курсор'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        self.ordering = getattr(view, 'cursor_ordering', self.ordering)
+        page_size = self.get_page_size(request)
+        queryset = queryset.order_by(*self.ordering)
+        position = self.decode_cursor(request, queryset)
+        if position is not None:
+            queryset = queryset.filter(self.get_position_filter(position))
+        results = list(queryset[:page_size + 1])
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = self.get_position(results[-1])
+        return results
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('next', self.get_next_link()),
+            ('results', data),
+        ]))
+
+    def get_page_size(self, request):
+        try:
+            return _positive_int(
+                request.query_params[self.page_size_query_param],
+                strict=True,
+            )
+        except (KeyError, ValueError):
+            return self.page_size
+
+    def get_next_link(self):
+        if self.next_position is None:
+            return None
+        return replace_query_param(self.request.build_absolute_uri(),
+                                   self.cursor_query_param,
+                                   self.encode_cursor(self.next_position))
+
+    def get_position(self, obj):
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def get_position_filter(self, position):
+        condition = Q()
+        equal = Q()
+        for field, value in zip(self.ordering, position):
+            name = field.lstrip('-')
+            lookup = 'lt' if field.startswith('-') else 'gt'
+            condition |= equal & Q(**{f'{name}__{lookup}': value})
+            equal &= Q(**{name: value})
+        return condition
+
+    def encode_cursor(self, position):
+        data = json.dumps([str(value) for value in position])
+        return base64.urlsafe_b64encode(data.encode()).decode()
+
+    def get_cursor_field(self, queryset, name):
+        """Поле ключа сортировки: поле модели или аннотация."""
+        if name in queryset.query.annotations:
+            return queryset.query.annotations[name].output_field
+        return queryset.model._meta.get_field(name)
+
+    def decode_cursor(self, request, queryset):
+        cursor = request.query_params.get(self.cursor_query_param)
+        if not cursor:
+            return None
+        try:
+            values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+            if len(values) != len(self.ordering):
+                raise ValueError
+            return [
+                self.get_cursor_field(queryset,
+                                      field.lstrip('-')).to_python(value)
+                for field, value in zip(self.ordering, values)
+            ]
+        except (TypeError, ValueError, ValidationError, binascii.Error):
+            raise NotFound(self.invalid_cursor_message)
+
+
+class FeedPaginator(KeysetPaginator):
+    """Keyset-пагинация по нескольким источникам ленты.
+
+    Источник - queryset словарей с pub_date и recipe_id. Из каждого
+    берется страница после курсора, страницы сливаются по ключу
+    сортировки без повторов рецептов.
+    """
+
+    ordering = ('-pub_date', '-recipe_id')
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        page_size = self.get_page_size(request)
+        position = self.decode_cursor(request, FeedEntry.objects.all())
+        pages = []
+        for source in queryset:
+            source = source.order_by(*self.ordering)
+            if position is not None:
+                source = source.filter(self.get_position_filter(position))
+            pages.append(list(source[:page_size + 1]))
+        results = []
+        seen = set()
+        for item in heapq.merge(*pages, key=self.get_position,
+                                reverse=True):
+            if item['recipe_id'] not in seen:
+                seen.add(item['recipe_id'])
+                results.append(item)
+        self.next_position = None
+        if len(results) > page_size:
+            results = results[:page_size]
+            self.next_position = self.get_position(results[-1])
+        return results
+
+    def get_position(self, obj):
+        return [obj[field.lstrip('-')] for field in self.ordering]
 
 
 class LimitPaginator(PageNumberPagination):
+    """Постраничная пагинация с переходом на курсор по ?cursor=."""
+
     page_size_query_param = 'limit'
+    cursor_query_param = 'cursor'
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.keyset = None
+        if self.cursor_query_param in request.query_params:
+            self.keyset = KeysetPaginator()
+            return self.keyset.paginate_queryset(queryset, request, view)
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.keyset is not None:
+            return self.keyset.get_paginated_response(data)
+        return super().get_paginated_response(data)
@@ -0,0 +1,92 @@
+import math
+from datetime import datetime, timezone
+
+from constants.constants import (FAVORITE_SCORE_WEIGHT,
+                                 POPULARITY_HALF_LIFE_DAYS,
+                                 SHOPLIST_SCORE_WEIGHT,
+                                 TRENDING_HALF_LIFE_DAYS)
+from recipe.models import Favorite, Recipe, ShopList
+
+
+SCORE_EPOCH = datetime(2024, 1, 1, tzinfo=timezone.utc)
+SCORES = {
+    'popularity_score': POPULARITY_HALF_LIFE_DAYS,
+    'trending_score': TRENDING_HALF_LIFE_DAYS,
+}
+EVENTS = ((Favorite, FAVORITE_SCORE_WEIGHT),
+          (ShopList, SHOPLIST_SCORE_WEIGHT))
+
+
+def log_sum_exp(values):
+    top = max(values)
+    return top + math.log(sum(math.exp(value - top) for value in values))
+
+
+def exponent(created, weight, half_life_days):
+    """Вклад события в логарифмической шкале относительно SCORE_EPOCH."""
+    age = (created - SCORE_EPOCH).total_seconds() / 86400
+    return math.log(weight) + age / half_life_days * math.log(2)
+
+
+def calculate_scores(recipe_ids):
+    """Рейтинги рецептов по избранному и спискам покупок.
+
+    Рейтинг - сумма весов событий, затухающая вдвое за период
+    полураспада. Затухание считается от общей точки SCORE_EPOCH, так
+    что с течением времени все рейтинги делятся на один множитель и
+    порядок рецептов не меняется: пересчитывать нужно только рецепты
+    с новыми событиями. Хранится ln(1 + сумма), это исключает
+    переполнение.
+    """
+    exponents = {recipe_id: {field: [0.0] for field in SCORES}
+                 for recipe_id in recipe_ids}
+    for model, weight in EVENTS:
+        events = (model.objects.filter(recipe_id__in=recipe_ids)
+                  .values_list('recipe_id', 'created'))
+        for recipe_id, created in events.iterator():
+            for field, half_life in SCORES.items():
+                exponents[recipe_id][field].append(
+                    exponent(created, weight, half_life))
+    return {
+        recipe_id: {field: log_sum_exp(values)
+                    for field, values in fields.items()}
+        for recipe_id, fields in exponents.items()
+    }
+
+
+def refresh_scores(recipe_ids, batch_size):
+    """Пересчитывает рейтинги пачками, возвращает число изменений.
+
+    Записываются только рецепты, рейтинг которых изменился.
+    """
+    recipe_ids = list(recipe_ids)
+    changed = 0
+    for start in range(0, len(recipe_ids), batch_size):
+        batch = recipe_ids[start:start + batch_size]
+        scores = calculate_scores(batch)
+        recipes = [
+            recipe for recipe in Recipe.objects.filter(id__in=batch)
+            .only('id', *SCORES)
+            if set_scores(recipe, scores[recipe.id])
+        ]
+        Recipe.objects.bulk_update(recipes, list(SCORES))
+        changed += len(recipes)
+    return changed
+
+
+def set_scores(recipe, scores):
+    changed = False
+    for field, value in scores.items():
+        if not math.isclose(getattr(recipe, field), value):
+            setattr(recipe, field, value)
+            changed = True
+    return changed
+
+
+def get_active_recipes(since):
+    """Рецепты с событиями после since."""
+    recipe_ids = set()
+    for model, _ in EVENTS:
+        recipe_ids.update(model.objects.filter(created__gte=since)
+                          .values_list('recipe_id', flat=True))
+    return recipe_ids
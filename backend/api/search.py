@@ -0,0 +1,39 @@
+from functools import reduce
+from operator import add
+
+from django.contrib.postgres.search import SearchQuery, SearchRank
+from django.db import connection
+from django.db.models import Case, F, FloatField, Q, Value, When
+from django.db.models.functions import Cast
+
+from constants.constants import (SEARCH_CONFIG,
+                                 SEARCH_NAME_WEIGHT,
+                                 SEARCH_TEXT_WEIGHT)
+
+
+def search_recipes(queryset, text):
+    """Рецепты по поисковому запросу с релевантностью в search_rank.
+
+    В PostgreSQL поиск идет по search_vector через GIN-индекс,
+    вектор поддерживает триггер. В SQLite каждое слово запроса
+    ищется в name и text, совпадение в названии весит больше.
+    """
+    if connection.vendor == 'postgresql':
+        query = SearchQuery(text, config=SEARCH_CONFIG,
+                            search_type='websearch')
+        return queryset.filter(search_vector=query).annotate(
+            search_rank=Cast(SearchRank(F('search_vector'), query),
+                             FloatField()),
+        )
+    words = text.split()
+    if not words:
+        return queryset.none()
+    for word in words:
+        queryset = queryset.filter(Q(name__icontains=word)
+                                   | Q(text__icontains=word))
+    return queryset.annotate(search_rank=reduce(add, (
+        Case(When(name__icontains=word, then=Value(SEARCH_NAME_WEIGHT)),
+             default=Value(SEARCH_TEXT_WEIGHT),
+             output_field=FloatField())
+        for word in words
+    )))
@@ -1,21 +1,46 @@
+from collections import Counter
+
+from django.db import models, transaction
 from djoser.serializers import UserCreateSerializer
 from drf_base64.fields import Base64ImageField
 from rest_framework import serializers
 
 from constants.constants import (MAX_AMOUNT_VALUE,
+                                 MAX_BULK_RECIPES,
                                  MAX_COOK_TIME_VALUE,
                                  MIN_AMOUNT_VALUE,
-                                 MIN_COOK_TIME_VALUE)
+                                 MIN_COOK_TIME_VALUE,
+                                 RECIPE_ORDERINGS)
 from user.models import User, Subscribe
 from recipe.models import (Favorite,
+                           FeedEntry,
                            Ingredient,
                            Recipe,
                            RecipeToIngredient,
                            ShopList,
+                           ShopListIngredient,
                            Tag)
 
+from .cache import recipe_cards
+from .images import IMAGE_VARIANTS, schedule_variants
+
+
+class SubscribedMixin:
+    """is_subscribed по подпискам пользователя, загруженным раз на ответ."""
+
+    def get_is_subscribed(self, obj):
+        request = self.context.get('request')
+        if not request or not request.user.is_authenticated:
+            return False
+        if 'subscribed_ids' not in self.context:
+            self.context['subscribed_ids'] = set(
+                Subscribe.objects.filter(user=request.user)
+                .values_list('author_id', flat=True)
+            )
+        return obj.id in self.context['subscribed_ids']
+
 
-class SignUpSerializer(UserCreateSerializer):
+class SignUpSerializer(SubscribedMixin, UserCreateSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
 
     class Meta:
@@ -30,15 +55,6 @@ class SignUpSerializer(UserCreateSerializer):
         extra_kwargs = {'password': {'write_only': True}}
         model = User
 
-    def get_is_subscribed(self, obj):
-        request = self.context.get('request')
-        if not request:
-            return False
-        user = request.user
-        if user.is_authenticated:
-            return obj.author.filter(user=user).exists()
-        return False
-
 
 class ChangePasswordSerializer(serializers.Serializer):
     new_password = serializers.CharField(max_length=256)
@@ -81,6 +97,19 @@ class RecipeToIngredientSerializer(serializers.ModelSerializer):
         model = RecipeToIngredient
 
 
+class RecipeCardListSerializer(serializers.ListSerializer):
+    """Загружает карточки страницы из кэша одним запросом."""
+
+    def to_representation(self, data):
+        if isinstance(data, models.Manager):
+            data = data.all()
+        recipes = list(data)
+        self.child.load_cards(recipes)
+        representation = super().to_representation(recipes)
+        self.child.save_cards()
+        return representation
+
+
 class RecipeGetListSerializer(serializers.ModelSerializer):
     ingredients = RecipeToIngredientSerializer(many=True,
                                                source='recipe_ingredients')
@@ -89,6 +118,8 @@ class RecipeGetListSerializer(serializers.ModelSerializer):
     image = Base64ImageField(required=True, allow_null=False)
     is_favorited = serializers.SerializerMethodField()
     is_in_shopping_cart = serializers.SerializerMethodField()
+    image_card = serializers.SerializerMethodField()
+    image_detail = serializers.SerializerMethodField()
 
     class Meta:
         model = Recipe
@@ -100,22 +131,132 @@ class RecipeGetListSerializer(serializers.ModelSerializer):
                   'name',
                   'text',
                   'image',
+                  'image_card',
+                  'image_detail',
                   'cooking_time',
                   'is_in_shopping_cart')
+        list_serializer_class = RecipeCardListSerializer
+
+    cards = None
+    card_prefetch = (
+        models.Prefetch('tags', queryset=Tag.objects.all()),
+        models.Prefetch('recipe_ingredients',
+                        queryset=(RecipeToIngredient.objects
+                                  .select_related('ingredient'))),
+    )
+
+    def load_cards(self, recipes):
+        """Карточки из кэша, связи загружаются только для промахов."""
+        self.generation = recipe_cards.get_generation()
+        self.cards, self.versions = recipe_cards.get_many(
+            [recipe.id for recipe in recipes], self.generation)
+        self.new_cards = {}
+        models.prefetch_related_objects(
+            [recipe for recipe in recipes if recipe.id not in self.cards],
+            *self.card_prefetch,
+        )
+
+    def save_cards(self):
+        recipe_cards.set_many(self.new_cards, self.versions,
+                              self.generation)
+        self.cards = None
+
+    def to_representation(self, instance):
+        if self.cards is None:
+            self.load_cards([instance])
+            representation = self.to_representation(instance)
+            self.save_cards()
+            return representation
+        card = self.cards.get(instance.id)
+        if card is None:
+            card = self.build_card(instance)
+            self.new_cards[instance.id] = card
+        return self.personalize(card, instance)
+
+    def build_card(self, instance):
+        """Карточка рецепта без обхода полей DRF.
+
+        Повторяет вывод полей сериализатора по предзагруженным связям,
+        поля запроса заполняются в personalize.
+        """
+        author = instance.author
+        return {
+            'id': instance.id,
+            'tags': [
+                {'id': tag.id,
+                 'name': tag.name,
+                 'color': tag.color,
+                 'slug': tag.slug}
+                for tag in instance.tags.all()
+            ],
+            'author': {
+                'id': author.id,
+                'email': author.email,
+                'first_name': author.first_name,
+                'last_name': author.last_name,
+                'username': author.username,
+                'is_subscribed': False,
+            },
+            'ingredients': [
+                {'id': line.ingredient.id,
+                 'name': line.ingredient.name,
+                 'measurement_unit': line.ingredient.measurement_unit,
+                 'amount': line.amount}
+                for line in instance.recipe_ingredients.all()
+            ],
+            'is_favorited': False,
+            'name': instance.name,
+            'text': instance.text,
+            'image': None,
+            'image_card': None,
+            'image_detail': None,
+            'cooking_time': instance.cooking_time,
+            'is_in_shopping_cart': False,
+        }
+
+    def personalize(self, card, instance):
+        """Накладывает на карточку поля, зависящие от запроса."""
+        representation = dict(card)
+        representation['author'] = dict(
+            card['author'],
+            is_subscribed=self.fields['author'].get_is_subscribed(
+                instance.author),
+        )
+        representation['image'] = self.fields['image'].to_representation(
+            instance.image)
+        representation['image_card'] = self.get_image_card(instance)
+        representation['image_detail'] = self.get_image_detail(instance)
+        representation['is_favorited'] = self.get_is_favorited(instance)
+        representation['is_in_shopping_cart'] = (
+            self.get_is_in_shopping_cart(instance))
+        return representation
+
+    def get_image_variant(self, obj, name):
+        """Ссылка на вариант изображения, до обработки - на оригинал."""
+        return self.fields['image'].to_representation(
+            getattr(obj, name) or obj.image)
+
+    def get_image_card(self, obj):
+        return self.get_image_variant(obj, 'image_card')
+
+    def get_image_detail(self, obj):
+        return self.get_image_variant(obj, 'image_detail')
+
+    def get_user_flag(self, obj, name, model):
+        """Флаг текущего пользователя: из аннотации или запросом."""
+        user = self.context['request'].user
+        if not user.is_authenticated:
+            return False
+        value = getattr(obj, name, None)
+        if value is not None:
+            return value
+        return model.objects.filter(user=user, recipe=obj).exists()
 
     def get_is_favorited(self, obj):
-        if (self.context['request'].user.is_authenticated
-            and Favorite.objects.filter(user=self.context['request'].user,
-                                        recipe=obj).exists()):
-            return True
-        return False
+        return self.get_user_flag(obj, 'is_favorited', Favorite)
 
     def get_is_in_shopping_cart(self, obj):
-        if (self.context['request'].user.is_authenticated
-            and ShopList.objects.filter(user=self.context['request'].user,
-                                        recipe=obj).exists()):
-            return True
-        return False
+        return self.get_user_flag(obj, 'is_in_shopping_cart', ShopList)
 
 
 class AddIngredientToRecipe(serializers.ModelSerializer):
@@ -136,9 +277,36 @@ class AddIngredientToRecipe(serializers.ModelSerializer):
         )
 
 
+def resolve_ids(model, ids, label):
+    """Объекты модели в порядке ids и список ошибок по ним."""
+    objects = model.objects.in_bulk(ids)
+    errors = []
+    missing = [pk for pk in dict.fromkeys(ids) if pk not in objects]
+    if missing:
+        errors.append(f'{label} не найдены: '
+                      f'{", ".join(map(str, missing))}')
+    duplicates = [pk for pk, count in Counter(ids).items() if count > 1]
+    if duplicates:
+        errors.append(f'{label} повторяются: '
+                      f'{", ".join(map(str, duplicates))}')
+    return [objects.get(pk) for pk in ids], errors
+
+
+class PrimaryKeyListField(serializers.ListField):
+    """Список id связанных объектов.
+
+    В отличие от PrimaryKeyRelatedField(many=True) не проверяет id
+    по одному: объекты загружаются в validate сериализатора.
+    """
+
+    child = serializers.IntegerField(min_value=1)
+
+    def to_representation(self, data):
+        return [item.pk for item in data.all()]
+
+
 class RecipesCreateSerializer(serializers.ModelSerializer):
-    tags = serializers.PrimaryKeyRelatedField(many=True,
-                                              queryset=Tag.objects.all())
+    tags = PrimaryKeyListField()
     ingredients = AddIngredientToRecipe(many=True)
     image = Base64ImageField(required=True, allow_null=False)
 
@@ -161,66 +329,129 @@ class RecipesCreateSerializer(serializers.ModelSerializer):
              f'{MIN_AMOUNT_VALUE} <= cooking_time <= {MAX_AMOUNT_VALUE}')
         )
 
+    def validate(self, data):
+        """Загружает тэги и ингредиенты по id одним запросом на модель.
+
+        Неизвестные и повторяющиеся id собираются в одну ошибку.
+        """
+        errors = {}
+        if 'tags' in data:
+            tags, tag_errors = resolve_ids(Tag, data['tags'], 'Тэги')
+            data['tags'] = tags
+            if tag_errors:
+                errors['tags'] = tag_errors
+        if 'ingredients' in data:
+            ingredients, ingredient_errors = resolve_ids(
+                Ingredient,
+                [line['ingredient']['id'] for line in data['ingredients']],
+                'Ингредиенты',
+            )
+            for line, ingredient in zip(data['ingredients'], ingredients):
+                line['ingredient'] = ingredient
+            if ingredient_errors:
+                errors['ingredients'] = ingredient_errors
+        if errors:
+            raise serializers.ValidationError(errors)
+        return data
+
     def create(self, validated_data):
-        ingredient_list = []
         ingredients = validated_data.pop('ingredients')
         tags = validated_data.pop('tags')
         recipe = Recipe.objects.create(**validated_data)
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            ingredient_id = (Ingredient
-                             .objects.get(id=ingredient['ingredient']['id']))
-            ingredient_list.append(RecipeToIngredient(recipe=recipe,
-                                                      ingredient=ingredient_id,
-                                                      amount=amount))
-        RecipeToIngredient.objects.bulk_create(ingredient_list)
+        RecipeToIngredient.objects.bulk_create(
+            RecipeToIngredient(recipe=recipe,
+                               ingredient=line['ingredient'],
+                               amount=line['amount'])
+            for line in ingredients
+        )
         recipe.tags.set(tags)
+        schedule_variants(recipe.id)
         return recipe
 
+    def update_ingredients(self, instance, ingredients):
+        """Приводит строки рецепта к списку по разнице с текущими.
+
+        Удаляются и создаются только отличающиеся строки, изменившиеся
+        количества обновляются одним запросом. Суммы в списках покупок
+        пересчитываются, только если состав рецепта поменялся.
+        """
+        current = {line.ingredient_id: line
+                   for line in instance.recipe_ingredients.all()}
+        amounts = {line['ingredient'].id: line['amount']
+                   for line in ingredients}
+        removed = current.keys() - amounts.keys()
+        added = [RecipeToIngredient(recipe=instance,
+                                    ingredient=line['ingredient'],
+                                    amount=line['amount'])
+                 for line in ingredients
+                 if line['ingredient'].id not in current]
+        changed = []
+        for ingredient_id, line in current.items():
+            amount = amounts.get(ingredient_id, line.amount)
+            if amount != line.amount:
+                line.amount = amount
+                changed.append(line)
+        if not (removed or added or changed):
+            return
+        if removed:
+            RecipeToIngredient.objects.filter(
+                recipe=instance, ingredient_id__in=removed).delete()
+        RecipeToIngredient.objects.bulk_create(added)
+        RecipeToIngredient.objects.bulk_update(changed, ['amount'])
+        ShopListIngredient.objects.recalculate(
+            removed | amounts.keys(), recipe_id=instance.id)
+
+    @transaction.atomic
     def update(self, instance, validated_data):
-        ingredient_list = []
-        ingredients = validated_data.pop('ingredients', [])
-        tags = validated_data.pop('tags')
-        RecipeToIngredient.objects.filter(recipe=instance).delete()
-        for ingredient in ingredients:
-            amount = ingredient['amount']
-            ingredient_id = (Ingredient.objects
-                             .get(id=ingredient['ingredient']['id']))
-            ingredient_list.append(RecipeToIngredient(recipe=instance,
-                                                      ingredient=ingredient_id,
-                                                      amount=amount))
-        RecipeToIngredient.objects.bulk_create(ingredient_list)
-        instance.tags.set(tags)
-        return super().update(instance=instance, validated_data=validated_data)
+        ingredients = validated_data.pop('ingredients', None)
+        tags = validated_data.pop('tags', None)
+        if ingredients is not None:
+            self.update_ingredients(instance, ingredients)
+        if tags is not None:
+            instance.tags.set(tags)
+        instance = super().update(instance=instance,
+                                  validated_data=validated_data)
+        if 'image' in validated_data:
+            variants = dict.fromkeys(IMAGE_VARIANTS, '')
+            Recipe.objects.filter(id=instance.id).update(**variants)
+            for field, value in variants.items():
+                setattr(instance, field, value)
+            schedule_variants(instance.id)
+        return instance
+
+
+class UserRecipeListSerializer(serializers.Serializer):
+    """Добавление рецепта из context в список пользователя.
+
+    Запись делается одним INSERT ... ON CONFLICT DO NOTHING, повторное
+    добавление дает ошибку валидации вместо IntegrityError.
+    """
+
+    model = None
+    exists_message = None
 
+    def create(self, validated_data):
+        recipe = self.context['recipe']
+        user_id = self.context['request'].user.id
+        if not self.model.objects.add_many(user_id, [recipe.id]):
+            raise serializers.ValidationError({'errors':
+                                               self.exists_message})
+        return recipe
 
-class FavoriteSerializer(serializers.ModelSerializer):
+    def to_representation(self, instance):
+        return BaseRecipeSerializer(instance).data
 
-    class Meta:
-        model = Favorite
-        fields = ('user',
-                  'recipe')
 
-    def validate(self, data):
-        if Favorite.objects.filter(user=data['user'],
-                                   recipe=data['recipe']).exists():
-            raise serializers.ValidationError({'errors':
-                                               'Рецепт уже в избранном'})
-        return data
-
-    def create(self, validated_data):
-        user = validated_data['user']
-        recipe = validated_data['recipe']
-        FavoriteRecipe = Favorite.objects.create(user=user, recipe=recipe)
-        FavoriteRecipe.save()
-        return BaseRecipeSerializer(recipe).data
+class FavoriteSerializer(UserRecipeListSerializer):
+    model = Favorite
+    exists_message = 'Рецепт уже в избранном'
 
 
-class SubscriceListSerializer(serializers.ModelSerializer):
+class SubscriceListSerializer(SubscribedMixin, serializers.ModelSerializer):
     is_subscribed = serializers.SerializerMethodField(read_only=True)
     recipes = serializers.SerializerMethodField(read_only=True)
-    recipe_count = serializers.IntegerField(read_only=True,
-                                            source='recipes.count')
+    recipe_count = serializers.IntegerField(source='recipes_count',
+                                            read_only=True)
 
     class Meta:
         model = User
@@ -228,69 +459,76 @@ class SubscriceListSerializer(serializers.ModelSerializer):
                   'last_name', 'is_subscribed', 'recipes',
                   'recipe_count')
 
-    def get_is_subscribed(self, obj):
-        user = self.context.get('user')
-        return obj.author.filter(user=user).exists()
-
     def get_recipes(self, obj):
-        request = self.context.get('request')
-        limit = request.query_params.get('recipes_limit')
-        if limit is None:
+        """Последние рецепты автора, не больше recipes_limit."""
+        recipes = getattr(obj, 'limited_recipes', None)
+        if recipes is None:
             recipes = obj.recipes.all()
-        else:
-            recipes = obj.recipes.all()[:int(limit)]
+            limit = self.context.get('recipes_limit')
+            if limit is not None:
+                recipes = recipes[:limit]
         return BaseRecipeSerializer(recipes, many=True).data
 
 
-class SubscribeSerializer(serializers.ModelSerializer):
-
-    class Meta:
-        model = Subscribe
-        fields = ('user', 'author')
+class SubscribeSerializer(serializers.Serializer):
+    """Подписка на автора из context одним INSERT."""
 
-    def validate(self, validated_data):
-        user = validated_data['user']
-        author = validated_data['author']
-        if user == author:
+    def validate(self, data):
+        if self.context['request'].user == self.context['author']:
             raise serializers.ValidationError(
                 {'errors':
                     'Вы не можете подписаться на себя'})
-        if Subscribe.objects.filter(user=user,
-                                    author=author).exists():
+        return data
+
+    @transaction.atomic
+    def create(self, validated_data):
+        author = self.context['author']
+        user_id = self.context['request'].user.id
+        if not Subscribe.objects.subscribe(user_id, author.id):
             raise serializers.ValidationError({'errors':
                                                'Вы уже подписаны'})
+        FeedEntry.objects.backfill(user_id, author.id)
+        return author
+
+    def to_representation(self, instance):
+        return SubscriceListSerializer(instance, context=self.context).data
 
-        return validated_data
 
+class ShopListSerializer(UserRecipeListSerializer):
+    model = ShopList
+    exists_message = 'Рецепт уже в списке'
+
+    @transaction.atomic
     def create(self, validated_data):
-        request = self.context.get('request')
-        author = validated_data['author']
-        user = validated_data['user']
-        Subscribe.objects.create(user=user, author=author)
-        return SubscriceListSerializer(author, context={'user': author,
-                                                        'request':
-                                                        request}).data
+        recipe = super().create(validated_data)
+        ShopListIngredient.objects.add_recipes(
+            [recipe.id], self.context['request'].user.id)
+        return recipe
 
 
-class ShopListSerializer(serializers.ModelSerializer):
+class RecipesLimitSerializer(serializers.Serializer):
+    recipes_limit = serializers.IntegerField(min_value=0, required=False)
 
-    class Meta:
-        model = ShopList
-        fields = ('user', 'recipe')
 
-    def validate(self, validated_data):
-        user = validated_data['user']
-        recipe = validated_data['recipe']
+class RecipesOrderingSerializer(serializers.Serializer):
+    ordering = serializers.ChoiceField(choices=list(RECIPE_ORDERINGS),
+                                       required=False)
+    search = serializers.CharField(required=False, allow_blank=True)
 
-        if ShopList.objects.filter(user=user,
-                                   recipe=recipe).exists():
-            raise serializers.ValidationError({'errors':
-                                               'Рецепт уже в списке'})
+    def validate(self, data):
+        """По умолчанию результаты поиска сортируются по релевантности."""
+        ordering = data.setdefault(
+            'ordering', 'relevance' if data.get('search') else 'new')
+        if ordering == 'relevance' and not data.get('search'):
+            raise serializers.ValidationError(
+                {'ordering': 'Сортировка relevance доступна только '
+                             'вместе с search.'})
+        return data
 
-        return validated_data
 
-    def create(self, validated_data):
-        user = validated_data['user']
-        recipe = validated_data['recipe']
-        ShopList.objects.create(user=user, recipe=recipe)
-        return BaseRecipeSerializer(self.context.get('recipe')).data
+class RecipeIdsSerializer(serializers.Serializer):
+    ids = serializers.ListField(
+        child=serializers.IntegerField(min_value=1),
+        allow_empty=False,
+        max_length=MAX_BULK_RECIPES,
+    )
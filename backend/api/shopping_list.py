@@ -0,0 +1,164 @@
+import csv
+import io
+import json
+
+from django.conf import settings
+from rest_framework.renderers import BaseRenderer
+
+from recipe.models import ShopListIngredient
+
+try:
+    from reportlab.lib.pagesizes import A4
+    from reportlab.pdfbase import pdfmetrics
+    from reportlab.pdfbase.ttfonts import TTFError, TTFont
+    from reportlab.pdfgen import canvas
+except ImportError:
+    canvas = None
+
+
+TITLE = 'Список покупок'
+CHUNK_SIZE = 64 * 1024
+PDF_FONT_NAME = 'ShoppingList'
+PDF_FONT_SIZE = 12
+PDF_MARGIN = 50
+PDF_LINE_HEIGHT = 18
+
+
+def get_shopping_list(user):
+    """Суммы ингредиентов корзины пользователя одним запросом."""
+    return (ShopListIngredient.objects
+            .filter(user=user)
+            .values('ingredient__name',
+                    'ingredient__measurement_unit',
+                    'amount')
+            .order_by('ingredient__name'))
+
+
+def format_line(row):
+    return (f"{row['ingredient__name']} {row['amount']} - "
+            f"({row['ingredient__measurement_unit']})")
+
+
+def render_text(rows):
+    yield f'{TITLE}\n'
+    for row in rows.iterator():
+        yield f'{format_line(row)}\n'
+
+
+class Echo:
+    def write(self, value):
+        return value
+
+
+def render_csv(rows):
+    writer = csv.writer(Echo())
+    yield writer.writerow(('name', 'measurement_unit', 'amount'))
+    for row in rows.iterator():
+        yield writer.writerow((row['ingredient__name'],
+                               row['ingredient__measurement_unit'],
+                               row['amount']))
+
+
+def render_json(rows):
+    separator = '['
+    for row in rows.iterator():
+        yield separator + json.dumps(
+            {'name': row['ingredient__name'],
+             'measurement_unit': row['ingredient__measurement_unit'],
+             'amount': row['amount']},
+            ensure_ascii=False,
+        )
+        separator = ','
+    yield ']' if separator == ',' else '[]'
+
+
+def get_pdf_font():
+    if PDF_FONT_NAME in pdfmetrics.getRegisteredFontNames():
+        return PDF_FONT_NAME
+    try:
+        pdfmetrics.registerFont(
+            TTFont(PDF_FONT_NAME, settings.SHOPPING_LIST_PDF_FONT))
+    except (OSError, TTFError):
+        return 'Helvetica'
+    return PDF_FONT_NAME
+
+
+def render_pdf(rows):
+    """PDF по строкам итератора, с номерами страниц.
+
+    Число строк ограничено справочником ингредиентов, поэтому
+    документ собирается в буфере и отдается частями.
+    """
+    buffer = io.BytesIO()
+    pdf = canvas.Canvas(buffer, pagesize=A4)
+    font = get_pdf_font()
+    width, height = A4
+    page = 1
+
+    def start_page():
+        pdf.setFont(font, PDF_FONT_SIZE + 4)
+        pdf.drawString(PDF_MARGIN, height - PDF_MARGIN, TITLE)
+        pdf.setFont(font, PDF_FONT_SIZE - 2)
+        pdf.drawRightString(width - PDF_MARGIN, PDF_MARGIN / 2, str(page))
+        pdf.setFont(font, PDF_FONT_SIZE)
+        return height - PDF_MARGIN - 2 * PDF_LINE_HEIGHT
+
+    y = start_page()
+    for row in rows.iterator():
+        if y < PDF_MARGIN:
+            pdf.showPage()
+            page += 1
+            y = start_page()
+        pdf.drawString(PDF_MARGIN, y, format_line(row))
+        y -= PDF_LINE_HEIGHT
+    pdf.save()
+    view = buffer.getbuffer()
+    for start in range(0, len(view), CHUNK_SIZE):
+        yield bytes(view[start:start + CHUNK_SIZE])
+
+
+class ShoppingListRenderer(BaseRenderer):
+    """Формат выгрузки списка покупок для согласования контента.
+
+    Сам файл отдается потоком из вьюхи, рендерер сериализует
+    только ответы с ошибками.
+    """
+
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        return json.dumps(data, ensure_ascii=False).encode()
+
+
+class TextShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+
+class CSVShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+
+class JSONShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+
+class PDFShoppingListRenderer(ShoppingListRenderer):
+    media_type = 'application/pdf'
+    format = 'pdf'
+    charset = None
+
+
+EXPORT_FORMATS = {
+    'txt': render_text,
+    'csv': render_csv,
+    'json': render_json,
+}
+EXPORT_RENDERERS = [TextShoppingListRenderer,
+                    CSVShoppingListRenderer,
+                    JSONShoppingListRenderer]
+if canvas is not None:
+    EXPORT_FORMATS['pdf'] = render_pdf
+    EXPORT_RENDERERS.append(PDFShoppingListRenderer)
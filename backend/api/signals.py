@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import F
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from jobs.models import Job
+from recipe.models import (Favorite,
+                           FeedEntry,
+                           Ingredient,
+                           Recipe,
+                           RecipeToIngredient,
+                           ShopList,
+                           ShopListIngredient,
+                           Tag)
+from user.models import Subscribe, User
+
+from .cache import bump_after_commit, recipe_cards
+
+
+AUTHOR_CARD_FIELDS = {'email', 'username', 'first_name', 'last_name'}
+
+
+def invalidate_cards(recipe_ids):
+    recipe_ids = list(recipe_ids)
+    if recipe_ids:
+        transaction.on_commit(lambda: recipe_cards.invalidate(recipe_ids))
+
+
+@receiver((post_save, post_delete), sender=Recipe)
+def recipe_changed(sender, instance, created=False, **kwargs):
+    invalidate_cards([instance.id])
+    bump_after_commit('recipes')
+    if created:
+        Job.objects.enqueue('api.feed.fan_out_recipe', instance.id)
+
+
+@receiver((post_save, post_delete), sender=RecipeToIngredient)
+def recipe_ingredient_changed(sender, instance, **kwargs):
+    invalidate_cards([instance.recipe_id])
+    bump_after_commit('recipes')
+    ShopListIngredient.objects.recalculate([instance.ingredient_id],
+                                           recipe_id=instance.recipe_id)
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def recipe_tags_changed(sender, instance, action, reverse, pk_set, **kwargs):
+    if not action.startswith('post_'):
+        return
+    bump_after_commit('recipes')
+    if not reverse:
+        invalidate_cards([instance.id])
+    elif pk_set:
+        invalidate_cards(pk_set)
+    else:
+        transaction.on_commit(recipe_cards.invalidate_all)
+
+
+@receiver((post_save, post_delete), sender=Tag)
+def tag_changed(sender, **kwargs):
+    transaction.on_commit(recipe_cards.invalidate_all)
+    bump_after_commit('tags')
+
+
+@receiver((post_save, post_delete), sender=Ingredient)
+def ingredient_changed(sender, **kwargs):
+    transaction.on_commit(recipe_cards.invalidate_all)
+    bump_after_commit('ingredients')
+
+
+@receiver(post_save, sender=User)
+def author_changed(sender, instance, created, update_fields=None,
+                   **kwargs):
+    if created or (update_fields
+                   and not AUTHOR_CARD_FIELDS & set(update_fields)):
+        return
+    invalidate_cards(instance.recipes.values_list('id', flat=True))
+    bump_after_commit('recipes')
+
+
+@receiver((post_save, post_delete), sender=Favorite)
+@receiver((post_save, post_delete), sender=ShopList)
+@receiver((post_save, post_delete), sender=Subscribe)
+def user_list_changed(sender, instance, **kwargs):
+    bump_after_commit(f'user:{instance.user_id}')
+
+
+@receiver(post_save, sender=Subscribe)
+def subscribe_created(sender, instance, created, **kwargs):
+    if created:
+        FeedEntry.objects.backfill(instance.user_id, instance.author_id)
+        Subscribe.objects.update_counters(instance.user_id,
+                                          instance.author_id, 1)
+
+
+@receiver(post_delete, sender=Subscribe)
+def subscribe_deleted(sender, instance, **kwargs):
+    FeedEntry.objects.prune(instance.user_id, instance.author_id)
+    Subscribe.objects.update_counters(instance.user_id,
+                                      instance.author_id, -1)
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_save, sender=ShopList)
+def user_list_added(sender, instance, created, **kwargs):
+    if created:
+        sender.objects.update_counters([instance.recipe_id], 1)
+
+
+@receiver(post_delete, sender=Favorite)
+@receiver(post_delete, sender=ShopList)
+def user_list_removed(sender, instance, **kwargs):
+    sender.objects.update_counters([instance.recipe_id], -1)
+
+
+@receiver(post_save, sender=ShopList)
+@receiver(post_delete, sender=ShopList)
+def shoplist_changed(sender, instance, created=True, **kwargs):
+    if created:
+        ShopListIngredient.objects.recalculate(
+            RecipeToIngredient.objects.filter(recipe_id=instance.recipe_id)
+            .values_list('ingredient_id', flat=True),
+            user_id=instance.user_id,
+        )
+
+
+@receiver(post_save, sender=Recipe)
+def recipe_created(sender, instance, created, **kwargs):
+    if created:
+        User.objects.filter(id=instance.author_id).update(
+            recipes_count=F('recipes_count') + 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def recipe_removed(sender, instance, **kwargs):
+    User.objects.filter(id=instance.author_id).update(
+        recipes_count=F('recipes_count') - 1)
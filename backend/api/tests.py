@@ -0,0 +1,535 @@
+import csv
+import io
+import json
+from concurrent.futures import ThreadPoolExecutor
+from threading import Barrier
+
+from django.contrib.auth.models import AnonymousUser
+from django.core.cache import cache
+from django.db import connection
+from django.db.models import prefetch_related_objects
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework import serializers
+from rest_framework.authtoken.models import Token
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from recipe.models import (Favorite,
+                           FeedEntry,
+                           Ingredient,
+                           Recipe,
+                           RecipeToIngredient,
+                           ShopList,
+                           ShopListIngredient,
+                           Tag)
+from user.models import Subscribe, User
+
+from .catalog import ingredient_catalog
+from .filters import RecipesFilters
+from .serializers import RecipeGetListSerializer
+from .shopping_list import EXPORT_FORMATS
+from .views import RecipesViewSet, UserViewSet
+
+
+class RecipeDataMixin:
+    """Пользователи, тэги и рецепты для тестов API."""
+
+    recipe_tags = ((0, 1), (1,), (2,), (0, 1, 2))
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.users = [
+            User.objects.create_user(username=f'user{number}',
+                                     email=f'user{number}@example.com',
+                                     password='password12345',
+                                     first_name='Имя',
+                                     last_name='Фамилия')
+            for number in range(2)
+        ]
+        cls.tags = [
+            Tag.objects.create(name=f'Тэг {number}', slug=f'tag{number}',
+                               color=f'#00000{number}')
+            for number in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Продукт {number}',
+                                      measurement_unit='г')
+            for number in range(3)
+        ]
+        cls.recipes = []
+        for number, tags in enumerate(cls.recipe_tags):
+            recipe = Recipe.objects.create(
+                author=cls.users[number % 2],
+                name=f'Рецепт {number}',
+                image='recipes/image.png',
+                text='Описание',
+                cooking_time=5,
+            )
+            recipe.tags.set([cls.tags[index] for index in tags])
+            RecipeToIngredient.objects.bulk_create(
+                RecipeToIngredient(recipe=recipe, ingredient=ingredient,
+                                   amount=10)
+                for ingredient in cls.ingredients
+            )
+            cls.recipes.append(recipe)
+
+    def setUp(self):
+        cache.clear()
+
+
+class RecipeTagsFilterTest(RecipeDataMixin, TestCase):
+
+    def filter_tags(self, *slugs):
+        return RecipesFilters(data={'tags': list(slugs)},
+                              queryset=Recipe.objects.all(),
+                              request=None).qs
+
+    def walk_plan(self, plan):
+        yield plan
+        for child in plan.get('Plans', ()):
+            yield from self.walk_plan(child)
+
+    def test_tags_filter_has_no_duplicates(self):
+        queryset = self.filter_tags('tag0', 'tag1')
+        ids = list(queryset.values_list('id', flat=True))
+        self.assertEqual(sorted(ids), [self.recipes[index].id
+                                       for index in (0, 1, 3)])
+        self.assertEqual(len(ids), len(set(ids)))
+
+    def test_tags_filter_plan_has_no_distinct(self):
+        """В плане нет DISTINCT и соединений, размножающих рецепты."""
+        queryset = self.filter_tags('tag0', 'tag1')
+        self.assertFalse(queryset.query.distinct)
+        self.assertNotIn('DISTINCT', str(queryset.query).upper())
+        if connection.vendor == 'postgresql':
+            sql, params = queryset.query.sql_with_params()
+            with connection.cursor() as cursor:
+                cursor.execute('EXPLAIN (ANALYZE, FORMAT JSON) ' + sql,
+                               params)
+                plan, = cursor.fetchone()[0]
+            for node in self.walk_plan(plan['Plan']):
+                if node is plan['Plan'] or 'Join Type' in node:
+                    self.assertLessEqual(node['Actual Rows'],
+                                         len(self.recipes))
+        else:
+            self.assertNotIn('DISTINCT', queryset.explain().upper())
+
+    def test_unknown_tag_in_stale_choices_is_skipped(self):
+        """Тэг, пропавший из снимка после проверки choices."""
+        filters = RecipesFilters(data={}, queryset=Recipe.objects.all(),
+                                 request=None)
+        queryset = filters.get_tags(Recipe.objects.all(), 'tags',
+                                    ['tag0', 'deleted'])
+        self.assertEqual(
+            set(queryset.values_list('id', flat=True)),
+            {self.recipes[0].id, self.recipes[3].id},
+        )
+        self.assertFalse(filters.get_tags(Recipe.objects.all(), 'tags',
+                                          ['deleted']).exists())
+
+
+class IngredientSearchTest(TestCase):
+
+    @classmethod
+    def setUpTestData(cls):
+        Ingredient.objects.bulk_create(
+            Ingredient(name=name, measurement_unit='г')
+            for name in ('ананас-абрикос', 'абрикосовый джем', 'Банан',
+                         'Абрикос', 'сушеный абрикос', 'Вода')
+        )
+
+    def setUp(self):
+        cache.clear()
+
+    def search(self, name, limit=None):
+        return [item['name']
+                for item in ingredient_catalog.search(name, limit)]
+
+    def test_prefix_matches_go_first(self):
+        self.assertEqual(self.search('абр'), ['Абрикос',
+                                              'абрикосовый джем',
+                                              'ананас-абрикос',
+                                              'сушеный абрикос'])
+
+    def test_limit(self):
+        self.assertEqual(self.search('абр', 1), ['Абрикос'])
+        self.assertEqual(self.search('абр', 3), ['Абрикос',
+                                                 'абрикосовый джем',
+                                                 'ананас-абрикос'])
+        self.assertEqual(self.search('абр', 0), [])
+
+    def test_api_limit(self):
+        client = APIClient()
+        response = client.get('/api/ingredients/',
+                              {'name': 'АБР', 'limit': 2})
+        self.assertEqual([item['name'] for item in response.json()],
+                         ['Абрикос', 'абрикосовый джем'])
+        response = client.get('/api/ingredients/',
+                              {'name': 'абр', 'limit': 0})
+        self.assertEqual(response.json(), [])
+
+
+class ShoppingListExportTest(RecipeDataMixin, TestCase):
+
+    url = '/api/recipes/download_shopping_cart/'
+
+    def setUp(self):
+        super().setUp()
+        reader = self.users[0]
+        self.client = APIClient()
+        self.client.force_authenticate(reader)
+        for recipe in self.recipes[:2]:
+            self.client.post(f'/api/recipes/{recipe.id}/shopping_cart/')
+
+    def download(self, export_format, content_type):
+        response = self.client.get(self.url, {'format': export_format})
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], content_type)
+        self.assertEqual(
+            response['Content-Disposition'],
+            f'attachment; filename="IngredientList.{export_format}"',
+        )
+        return b''.join(response.streaming_content)
+
+    def test_txt(self):
+        body = self.download('txt', 'text/plain; charset=utf-8').decode()
+        self.assertEqual(body.splitlines(), [
+            'Список покупок',
+            'Продукт 0 20 - (г)',
+            'Продукт 1 20 - (г)',
+            'Продукт 2 20 - (г)',
+        ])
+
+    def test_txt_is_default(self):
+        response = self.client.get(self.url)
+        self.assertEqual(response['Content-Type'],
+                         'text/plain; charset=utf-8')
+
+    def test_csv(self):
+        body = self.download('csv', 'text/csv; charset=utf-8').decode()
+        self.assertEqual(list(csv.reader(io.StringIO(body))), [
+            ['name', 'measurement_unit', 'amount'],
+            ['Продукт 0', 'г', '20'],
+            ['Продукт 1', 'г', '20'],
+            ['Продукт 2', 'г', '20'],
+        ])
+
+    def test_json(self):
+        body = self.download('json', 'application/json; charset=utf-8')
+        self.assertEqual(json.loads(body), [
+            {'name': f'Продукт {number}', 'measurement_unit': 'г',
+             'amount': 20}
+            for number in range(3)
+        ])
+
+    def test_json_empty_cart(self):
+        ShopList.objects.all().delete()
+        body = self.download('json', 'application/json; charset=utf-8')
+        self.assertEqual(json.loads(body), [])
+
+    def test_pdf(self):
+        if 'pdf' not in EXPORT_FORMATS:
+            self.skipTest('reportlab не установлен')
+        body = self.download('pdf', 'application/pdf')
+        self.assertTrue(body.startswith(b'%PDF'))
+        self.assertIn(b'%%EOF', body[-32:])
+
+    def test_unknown_format(self):
+        response = self.client.get(self.url, {'format': 'bogus'})
+        self.assertEqual(response.status_code, 404)
+
+    def test_anonymous(self):
+        response = APIClient().get(self.url)
+        self.assertEqual(response.status_code, 401)
+
+
+class RecipeSearchTest(RecipeDataMixin, TestCase):
+
+    url = '/api/recipes/'
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        first, second = cls.users
+        cls.by_name = cls.create_recipe(first, 'Красный борщ',
+                                        'Свекла, капуста и картофель',
+                                        cls.tags[0])
+        cls.by_text = cls.create_recipe(second, 'Суп дня',
+                                        'Почти как борщ, только без '
+                                        'капусты', cls.tags[0])
+        cls.by_both = cls.create_recipe(second, 'Зеленый борщ',
+                                        'Варим борщ со щавелем и яйцом',
+                                        cls.tags[1])
+
+    @classmethod
+    def create_recipe(cls, author, name, text, tag):
+        recipe = Recipe.objects.create(author=author, name=name, text=text,
+                                       image='recipes/image.png',
+                                       cooking_time=30)
+        recipe.tags.set([tag])
+        return recipe
+
+    def search(self, **params):
+        response = APIClient().get(self.url, params)
+        self.assertEqual(response.status_code, 200)
+        return response.json()
+
+    def get_ids(self, **params):
+        return [item['id'] for item in self.search(**params)['results']]
+
+    def test_name_match_ranks_above_text_match(self):
+        ids = self.get_ids(search='борщ')
+        self.assertEqual(len(ids), 3)
+        self.assertEqual(set(ids[:2]), {self.by_name.id, self.by_both.id})
+        self.assertEqual(ids[2], self.by_text.id)
+
+    def test_search_with_filters(self):
+        self.assertEqual(
+            self.get_ids(search='борщ', tags='tag0'),
+            [self.by_name.id, self.by_text.id],
+        )
+        self.assertEqual(
+            self.get_ids(search='борщ', tags=['tag0', 'tag1'],
+                         author=self.users[1].id),
+            [self.by_both.id, self.by_text.id],
+        )
+        self.assertEqual(self.get_ids(search='яйцом', tags='tag0'), [])
+        self.assertEqual(self.get_ids(search='яйцом'), [self.by_both.id])
+
+    def test_relevance_is_default_ordering(self):
+        self.assertEqual(self.get_ids(search='борщ'),
+                         self.get_ids(search='борщ', ordering='relevance'))
+        self.assertEqual(
+            set(self.get_ids(search='борщ', ordering='new')),
+            {self.by_name.id, self.by_text.id, self.by_both.id},
+        )
+
+    def test_cursor_pages_follow_relevance(self):
+        ids = []
+        page = self.search(search='борщ', limit=1, cursor='')
+        while True:
+            ids.extend(item['id'] for item in page['results'])
+            if page['next'] is None:
+                break
+            self.assertNotIn('count', page)
+            response = APIClient().get(page['next'])
+            self.assertEqual(response.status_code, 200)
+            page = response.json()
+        self.assertEqual(ids, self.get_ids(search='борщ'))
+
+    def test_relevance_without_search(self):
+        response = APIClient().get(self.url, {'ordering': 'relevance'})
+        self.assertEqual(response.status_code, 400)
+        self.assertIn('ordering', response.json())
+
+
+class RecipeCardTest(RecipeDataMixin, TestCase):
+    """build_card с personalize дает тот же вывод, что и поля DRF."""
+
+    def get_recipes(self, user):
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = user
+        recipes = list(
+            RecipesViewSet(request=request, action='list',
+                           format_kwarg=None).get_queryset()
+            .order_by('id')
+        )
+        prefetch_related_objects(recipes,
+                                 *RecipeGetListSerializer.card_prefetch)
+        return recipes, RecipeGetListSerializer(context={'request': request})
+
+    def assert_cards_match(self, user):
+        recipes, serializer = self.get_recipes(user)
+        for recipe in recipes:
+            with self.subTest(recipe=recipe.id):
+                expected = serializers.ModelSerializer.to_representation(
+                    serializer, recipe)
+                card = serializer.personalize(
+                    serializer.build_card(recipe), recipe)
+                self.assertEqual(list(card), list(expected))
+                self.assertEqual(card, expected)
+
+    def test_anonymous(self):
+        self.assert_cards_match(AnonymousUser())
+
+    def test_authenticated(self):
+        reader, author = self.users
+        recipe_ids = [recipe.id for recipe in self.recipes]
+        Favorite.objects.add_many(reader.id, recipe_ids[::2])
+        ShopList.objects.add_many(reader.id, recipe_ids[1::2])
+        Subscribe.objects.subscribe(reader.id, author.id)
+        Recipe.objects.filter(id=self.recipes[1].id).update(
+            image_card='recipes/card/image.webp')
+        self.assert_cards_match(reader)
+
+
+class RecipeCardCacheTest(RecipeDataMixin, TestCase):
+
+    def test_stale_card_is_not_saved_after_invalidation(self):
+        """Изменение рецепта между загрузкой и сохранением карточек."""
+        recipe = self.recipes[0]
+        request = Request(APIRequestFactory().get('/api/recipes/'))
+        request.user = AnonymousUser()
+        serializer = RecipeGetListSerializer(context={'request': request})
+        recipes = list(Recipe.objects.select_related('author')
+                       .filter(id=recipe.id))
+        serializer.load_cards(recipes)
+        with self.captureOnCommitCallbacks(execute=True):
+            Recipe.objects.get(id=recipe.id).tags.set([self.tags[2]])
+        stale = serializer.to_representation(recipes[0])
+        serializer.save_cards()
+        self.assertEqual([tag['slug'] for tag in stale['tags']],
+                         ['tag0', 'tag1'])
+        response = APIClient().get(f'/api/recipes/{recipe.id}/')
+        self.assertEqual([tag['slug'] for tag in response.json()['tags']],
+                         ['tag2'])
+
+    def test_card_is_cached_until_recipe_changes(self):
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        client = APIClient()
+        self.assertEqual(client.get(url).json()['name'], 'Рецепт 0')
+        with CaptureQueriesContext(connection) as queries:
+            client.get(url)
+        self.assertEqual(len(queries), 1)
+        with self.captureOnCommitCallbacks(execute=True):
+            recipe = Recipe.objects.get(id=self.recipes[0].id)
+            recipe.name = 'Новое название'
+            recipe.save()
+        self.assertEqual(client.get(url).json()['name'], 'Новое название')
+
+
+@override_settings(QUERY_BUDGET_STRICT=True)
+class QueryBudgetTest(RecipeDataMixin, TestCase):
+    """Число SQL-запросов не зависит от размера страницы.
+
+    Кэш в тестах - LocMemCache, как и рекомендуемый memcached он
+    не обращается к базе, поэтому считаются только запросы API.
+    Каждый адрес запрашивается дважды: с пустым и с прогретым кэшем.
+    """
+
+    recipe_tags = RecipeDataMixin.recipe_tags * 3
+
+    @classmethod
+    def setUpTestData(cls):
+        super().setUpTestData()
+        reader, author = cls.users
+        recipe_ids = [recipe.id for recipe in cls.recipes]
+        Favorite.objects.add_many(reader.id, recipe_ids[::3])
+        ShopList.objects.add_many(reader.id, recipe_ids[::2])
+        Subscribe.objects.subscribe(reader.id, author.id)
+        FeedEntry.objects.backfill(reader.id, author.id)
+        cls.token = Token.objects.create(user=reader)
+
+    def get_client(self, authenticated):
+        client = APIClient()
+        if authenticated:
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+        return client
+
+    def assert_budget(self, url, budget, authenticated=False):
+        client = self.get_client(authenticated)
+        cache.clear()
+        for attempt in ('cold', 'warm'):
+            with self.subTest(url=url, cache=attempt,
+                              authenticated=authenticated):
+                with CaptureQueriesContext(connection) as queries:
+                    response = client.get(url)
+                self.assertEqual(response.status_code, 200)
+                self.assertLessEqual(len(queries), budget, '\n'.join(
+                    query['sql'] for query in queries.captured_queries))
+
+    def test_recipes_list(self):
+        budget = RecipesViewSet.query_budget['list']
+        author = self.users[1].id
+        for authenticated in (False, True):
+            for query in ('', '?limit=12', '?tags=tag0&tags=tag2',
+                          f'?author={author}', '?ordering=popular'):
+                self.assert_budget('/api/recipes/' + query, budget,
+                                   authenticated)
+        for query in ('?is_favorited=1', '?is_in_shopping_cart=1',
+                      f'?is_favorited=1&tags=tag1&author={author}'):
+            self.assert_budget('/api/recipes/' + query, budget, True)
+
+    def test_recipes_retrieve(self):
+        budget = RecipesViewSet.query_budget['retrieve']
+        url = f'/api/recipes/{self.recipes[0].id}/'
+        self.assert_budget(url, budget)
+        self.assert_budget(url, budget, authenticated=True)
+
+    def test_feed(self):
+        self.assert_budget('/api/recipes/feed/',
+                           RecipesViewSet.query_budget['feed'],
+                           authenticated=True)
+
+    def test_subscriptions(self):
+        self.assert_budget('/api/users/subscriptions/?recipes_limit=2',
+                           UserViewSet.query_budget['subscriptions'],
+                           authenticated=True)
+
+
+class ConcurrentAddTest(RecipeDataMixin, TransactionTestCase):
+    """Одновременные запросы на добавление одной пары.
+
+    Ровно один запрос создает запись и меняет счетчики, остальные
+    получают 400, ни один не падает с ошибкой базы.
+    """
+
+    requests_count = 8
+
+    def setUp(self):
+        if connection.vendor == 'sqlite' and connection.is_in_memory_db():
+            self.skipTest('Общая SQLite в памяти блокирует таблицы '
+                          'без ожидания, нужна база в файле')
+        super().setUp()
+        self.setUpTestData()
+        self.reader, self.author = self.users
+        self.recipe = self.recipes[1]
+        self.token = Token.objects.create(user=self.reader)
+
+    def post_concurrently(self, url):
+        barrier = Barrier(self.requests_count)
+
+        def post():
+            client = APIClient(raise_request_exception=False)
+            client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+            barrier.wait()
+            try:
+                return client.post(url).status_code
+            finally:
+                connection.close()
+
+        with ThreadPoolExecutor(self.requests_count) as pool:
+            futures = [pool.submit(post)
+                       for _ in range(self.requests_count)]
+        statuses = sorted(future.result() for future in futures)
+        self.assertEqual(statuses,
+                         [201] + [400] * (self.requests_count - 1))
+
+    def test_favorite(self):
+        self.post_concurrently(f'/api/recipes/{self.recipe.id}/favorite/')
+        self.assertEqual(Favorite.objects.filter(user=self.reader).count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.favorites_count, 1)
+
+    def test_shopping_cart(self):
+        self.post_concurrently(
+            f'/api/recipes/{self.recipe.id}/shopping_cart/')
+        self.assertEqual(ShopList.objects.filter(user=self.reader).count(), 1)
+        self.recipe.refresh_from_db()
+        self.assertEqual(self.recipe.shopping_cart_count, 1)
+        self.assertEqual(
+            sorted(ShopListIngredient.objects.filter(user=self.reader)
+                   .values_list('ingredient_id', 'amount')),
+            sorted(self.recipe.recipe_ingredients
+                   .values_list('ingredient_id', 'amount')),
+        )
+
+    def test_subscribe(self):
+        self.post_concurrently(f'/api/users/{self.author.id}/subscribe/')
+        self.assertEqual(Subscribe.objects.filter(user=self.reader).count(),
+                         1)
+        self.reader.refresh_from_db()
+        self.author.refresh_from_db()
+        self.assertEqual(self.reader.following_count, 1)
+        self.assertEqual(self.author.followers_count, 1)
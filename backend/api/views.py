@@ -1,6 +1,8 @@
-from django.db.models import Sum
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.db import transaction
+from django.db.models import Exists, OuterRef, Prefetch, Subquery
 from django.shortcuts import get_object_or_404
-from django.http import HttpResponse
+from django.http import Http404, StreamingHttpResponse
 from django_filters.rest_framework import DjangoFilterBackend
 from rest_framework import filters, viewsets
 from rest_framework.decorators import action
@@ -8,16 +10,24 @@ from rest_framework.permissions import (IsAuthenticated,
                                         IsAuthenticatedOrReadOnly)
 from rest_framework.response import Response
 
+from constants.constants import RECIPE_ORDERINGS
 from recipe.models import (Favorite,
+                           FeedEntry,
                            Ingredient,
                            Tag,
                            Recipe,
-                           RecipeToIngredient,
-                           ShopList)
+                           ShopList,
+                           ShopListIngredient)
 from user.models import User, Subscribe
 
+from .cache import bump_after_commit
+from .catalog import ingredient_catalog, tag_catalog
 from .filters import IngedientNameFilter, RecipesFilters
-from .paginators import LimitPaginator
+from .mixins import (CatalogSnapshotMixin,
+                     ConditionalGetMixin,
+                     QueryBudgetMixin)
+from .feed import get_feed_sources
+from .paginators import FeedPaginator, LimitPaginator
 from .permissions import IsAuthorOrReadOnly
 from .serializers import (ChangePasswordSerializer,
                           SignUpSerializer,
@@ -25,19 +35,42 @@ from .serializers import (ChangePasswordSerializer,
                           IngredientSerializer,
                           TagSerializer,
                           RecipeGetListSerializer,
+                          RecipeIdsSerializer,
+                          RecipesLimitSerializer,
+                          RecipesOrderingSerializer,
                           RecipesCreateSerializer,
                           ShopListSerializer,
                           SubscribeSerializer,
                           SubscriceListSerializer,)
+from .shopping_list import (EXPORT_FORMATS,
+                            EXPORT_RENDERERS,
+                            get_shopping_list)
 
 
-class UserViewSet(viewsets.ModelViewSet):
+def get_recipes_limit(request):
+    serializer = RecipesLimitSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return serializer.validated_data.get('recipes_limit')
+
+
+def get_recipes_ordering(request):
+    serializer = RecipesOrderingSerializer(data=request.query_params)
+    serializer.is_valid(raise_exception=True)
+    return RECIPE_ORDERINGS[serializer.validated_data['ordering']]
+
+
+class UserViewSet(QueryBudgetMixin, viewsets.ModelViewSet):
     queryset = User.objects.all()
     serializer_class = SignUpSerializer
     filter_backends = (DjangoFilterBackend,
                        filters.SearchFilter)
     search_fields = ('username',)
     filterset_fields = ('username',)
+    cursor_ordering = ('id',)
+    # Авторизация, count, страница авторов, их рецепты, is_subscribed.
+    query_budget = {
+        'subscriptions': 5,
+    }
 
     @action(
         detail=False,
@@ -75,21 +108,25 @@ class UserViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated],
     )
     def subscribe(self, request, pk=None):
-        data = {'user': request.user.id,
-                'author': get_object_or_404(User, id=pk).id}
-        serializer = SubscribeSerializer(data=data,
-                                         context={'request':
-                                                  request})
+        serializer = SubscribeSerializer(
+            data={},
+            context={'request': request,
+                     'author': get_object_or_404(User, id=pk),
+                     'recipes_limit': get_recipes_limit(request)},
+        )
         serializer.is_valid(raise_exception=True)
-        response = serializer.save()
-        return Response(response, status=204)
+        serializer.save()
+        bump_after_commit(f'user:{request.user.id}')
+        return Response(serializer.data, status=201)
 
     @subscribe.mapping.delete
+    @transaction.atomic
     def delete_subscribe(self, request, pk=None):
-        get_object_or_404(Subscribe, user=request.user,
-                          author_id=pk).delete()
-        return Response({'message': 'Подписка удалена',
-                         'status': 204})
+        if not Subscribe.objects.unsubscribe(request.user.id, pk):
+            raise Http404
+        FeedEntry.objects.prune(request.user.id, pk)
+        bump_after_commit(f'user:{request.user.id}')
+        return Response({'message': 'Подписка удалена'}, status=204)
 
     @action(
         detail=False,
@@ -99,38 +136,119 @@ class UserViewSet(viewsets.ModelViewSet):
         pagination_class=LimitPaginator
     )
     def subscriptions(self, request):
-        user = request.user
-        subs = user.user.all()
-        subs_id_list = subs.values_list('author_id', flat=True)
-        subs_list = User.objects.filter(id__in=subs_id_list)
-        paginator = self.paginate_queryset(subs_list)
-        serializer = SubscriceListSerializer(paginator,
-                                             context={'request': request},
-                                             many=True)
+        recipes_limit = get_recipes_limit(request)
+        recipes = Recipe.objects.all()
+        if recipes_limit is not None:
+            recipes = recipes.filter(id__in=Subquery(
+                Recipe.objects.filter(author_id=OuterRef('author_id'))
+                .order_by('-pub_date', '-id')
+                .values('id')[:recipes_limit]
+            ))
+        authors = (
+            User.objects
+            .filter(author__user=request.user)
+            .prefetch_related(Prefetch('recipes',
+                                       queryset=recipes,
+                                       to_attr='limited_recipes'))
+            .order_by('id')
+        )
+        page = self.paginate_queryset(authors)
+        serializer = SubscriceListSerializer(
+            page,
+            context={'request': request,
+                     'recipes_limit': recipes_limit},
+            many=True,
+        )
         return self.get_paginated_response(serializer.data)
 
 
-class TagViewSet(viewsets.ModelViewSet):
+class TagViewSet(ConditionalGetMixin,
+                 CatalogSnapshotMixin,
+                 viewsets.ModelViewSet):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     pagination_class = None
+    conditional_versions = ('tags',)
+    catalog_snapshot = tag_catalog
 
 
-class IngredientViewSet(viewsets.ModelViewSet):
+class IngredientViewSet(ConditionalGetMixin,
+                        CatalogSnapshotMixin,
+                        viewsets.ModelViewSet):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngedientNameFilter
     pagination_class = None
+    conditional_versions = ('ingredients',)
+    catalog_snapshot = ingredient_catalog
 
+    def search_catalog(self, request):
+        name = request.query_params.get('name')
+        if not name:
+            return None
+        try:
+            limit = int(request.query_params['limit'])
+        except (KeyError, ValueError):
+            limit = None
+        return ingredient_catalog.search(name, limit and max(limit, 0),
+                                         self.get_catalog_version())
 
-class RecipesViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+
+class RecipesViewSet(QueryBudgetMixin,
+                     ConditionalGetMixin,
+                     viewsets.ModelViewSet):
+    queryset = (
+        Recipe.objects
+        .select_related('author')
+        .defer('search_vector')
+    )
     permission_classes = [IsAuthorOrReadOnly,
                           IsAuthenticatedOrReadOnly]
     http_method_names = ['get', 'post', 'patch', 'delete']
     filterset_class = RecipesFilters
     pagination_class = LimitPaginator
+    conditional_versions = ('recipes', 'tags', 'ingredients')
+    conditional_personalized = True
+    # Авторизация, count, страница, теги, ингредиенты, is_subscribed
+    # и запрос автора в фильтре author.
+    query_budget = {
+        'list': 8,
+        'retrieve': 6,
+        'feed': 8,
+    }
+
+    def initialize_request(self, request, *args, **kwargs):
+        """Изображение из multipart пишется во временный файл частями.
+
+        JSON с изображением в base64 принимается по-прежнему.
+        """
+        request.upload_handlers = [TemporaryFileUploadHandler(request)]
+        return super().initialize_request(request, *args, **kwargs)
+
+    @property
+    def cursor_ordering(self):
+        if self.action == 'list':
+            return get_recipes_ordering(self.request)
+        return RECIPE_ORDERINGS['new']
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        user = self.request.user
+        if not user.is_authenticated:
+            return queryset
+        return queryset.annotate(
+            is_favorited=Exists(Favorite.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+            is_in_shopping_cart=Exists(ShopList.objects.filter(
+                user=user, recipe=OuterRef('pk'))),
+        )
+
+    def filter_queryset(self, queryset):
+        queryset = super().filter_queryset(queryset)
+        if self.action == 'list':
+            queryset = queryset.order_by(*self.cursor_ordering)
+        return queryset
 
     def get_serializer_class(self):
         if self.action in ['create', 'partial_update']:
@@ -147,6 +265,26 @@ class RecipesViewSet(viewsets.ModelViewSet):
     def perform_update(self, serializer):
         serializer.save(author=self.request.user)
 
+    @action(
+        detail=False,
+        methods=(['GET']),
+        permission_classes=[IsAuthenticated],
+    )
+    def feed(self, request):
+        """Новые рецепты авторов из подписок пользователя."""
+        paginator = FeedPaginator()
+        entries = paginator.paginate_queryset(
+            get_feed_sources(request.user), request, self)
+        recipe_ids = [entry['recipe_id'] for entry in entries]
+        recipes = self.get_queryset().in_bulk(recipe_ids)
+        serializer = RecipeGetListSerializer(
+            [recipes[recipe_id] for recipe_id in recipe_ids
+             if recipe_id in recipes],
+            context=self.get_serializer_context(),
+            many=True,
+        )
+        return paginator.get_paginated_response(serializer.data)
+
     @action(
         detail=True,
         methods=(['POST']),
@@ -154,19 +292,30 @@ class RecipesViewSet(viewsets.ModelViewSet):
         permission_classes=[IsAuthenticated],
     )
     def favorite(self, request, pk=None):
-        data = {'user': request.user.id,
-                'recipe': get_object_or_404(Recipe, id=pk).id}
-        serializer = FavoriteSerializer(data=data)
-        serializer.is_valid(raise_exception=True)
-        data = serializer.save()
-        return Response(data, status=201)
+        return self.add_to_user_list(request, pk, FavoriteSerializer)
 
     @favorite.mapping.delete
     def delete_favorite(self, request, pk=None):
-        get_object_or_404(Favorite, user=request.user, recipe_id=pk).delete()
+        if not Favorite.objects.remove_many(request.user.id, [pk]):
+            raise Http404
+        bump_after_commit(f'user:{request.user.id}')
         return Response({'message': 'Рецепт успешно удален из избранного'},
                         status=204)
 
+    @action(
+        detail=False,
+        methods=(['POST']),
+        url_path='favorite',
+        url_name='favorite-bulk',
+        permission_classes=[IsAuthenticated],
+    )
+    def favorite_bulk(self, request):
+        return self.change_user_list(request, Favorite, add=True)
+
+    @favorite_bulk.mapping.delete
+    def delete_favorite_bulk(self, request):
+        return self.change_user_list(request, Favorite, add=False)
+
     @action(
         methods=(['POST']),
         permission_classes=(IsAuthenticated,),
@@ -174,46 +323,94 @@ class RecipesViewSet(viewsets.ModelViewSet):
         detail=True,
     )
     def shopping_cart(self, request, pk=None):
-        recipe = get_object_or_404(Recipe, id=pk)
-        data = {'user': request.user.id,
-                'recipe': recipe.id}
-        serializer = ShopListSerializer(data=data,
-                                        context={
-                                            'recipe': recipe})
-        serializer.is_valid(raise_exception=True)
-        response = serializer.save()
-        return Response(response)
+        return self.add_to_user_list(request, pk, ShopListSerializer)
 
     @shopping_cart.mapping.delete
+    @transaction.atomic
     def delete_shopping_cart(self, request, pk=None):
-        get_object_or_404(ShopList,
-                          user=request.user,
-                          recipe_id=pk).delete()
+        if not ShopList.objects.remove_many(request.user.id, [pk]):
+            raise Http404
+        ShopListIngredient.objects.remove_recipes([pk], request.user.id)
+        bump_after_commit(f'user:{request.user.id}')
         return Response({'message': 'Рецепт успешно удален из списка покупок'},
                         status=204)
 
+    @action(
+        detail=False,
+        methods=(['POST']),
+        url_path='shopping_cart',
+        url_name='shopping-cart-bulk',
+        permission_classes=[IsAuthenticated],
+    )
+    def shopping_cart_bulk(self, request):
+        return self.change_user_list(request, ShopList, add=True)
+
+    @shopping_cart_bulk.mapping.delete
+    def delete_shopping_cart_bulk(self, request):
+        return self.change_user_list(request, ShopList, add=False)
+
+    def add_to_user_list(self, request, pk, serializer_class):
+        serializer = serializer_class(
+            data={},
+            context={'request': request,
+                     'recipe': get_object_or_404(Recipe, id=pk)},
+        )
+        serializer.is_valid(raise_exception=True)
+        serializer.save()
+        bump_after_commit(f'user:{request.user.id}')
+        return Response(serializer.data, status=201)
+
+    @transaction.atomic
+    def change_user_list(self, request, model, add):
+        """Добавление или удаление списка рецептов одним запросом.
+
+        Для каждого id возвращает статус: added/removed, если запись
+        изменена, already_present/not_present, если менять было нечего,
+        и not_found для несуществующих рецептов.
+        """
+        serializer = RecipeIdsSerializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        recipe_ids = list(dict.fromkeys(serializer.validated_data['ids']))
+        existing = list(Recipe.objects.filter(id__in=recipe_ids)
+                        .order_by().values_list('id', flat=True))
+        user_id = request.user.id
+        if add:
+            changed = model.objects.add_many(user_id, existing)
+            statuses = ('added', 'already_present')
+        else:
+            changed = model.objects.remove_many(user_id, existing)
+            statuses = ('removed', 'not_present')
+        if model is ShopList:
+            totals = ShopListIngredient.objects
+            if add:
+                totals.add_recipes(list(changed), user_id)
+            else:
+                totals.remove_recipes(list(changed), user_id)
+        if changed:
+            bump_after_commit(f'user:{user_id}')
+        existing = set(existing)
+        return Response({'results': [
+            {'id': recipe_id,
+             'status': ('not_found' if recipe_id not in existing
+                        else statuses[recipe_id not in changed])}
+            for recipe_id in recipe_ids
+        ]})
+
     @action(
         methods=(['GET']),
         permission_classes=(IsAuthenticated,),
         detail=False,
+        renderer_classes=EXPORT_RENDERERS,
     )
     def download_shopping_cart(self, request):
-        shop_list = (ShopList.objects.filter(user=request.user)
-                     .values_list('recipe_id', flat=True))
-        download_list = (RecipeToIngredient
-                         .objects
-                         .filter(recipe__in=shop_list)
-                         .values('ingredient')
-                         .annotate(amount=Sum('amount'))
-                         .order_by('ingredient'))
-        out_txt = 'Список покупок\n'
-        for obj in download_list:
-            ingredient = Ingredient.objects.get(pk=obj['ingredient'])
-            amount = obj['amount']
-            out_txt = (out_txt + f'{ingredient.name} '
-                       + f'{amount} - '
-                       + f'({ingredient.measurement_unit})\n')
-        response = HttpResponse(out_txt, content_type='text/plain')
-        response['Content-Disposition'] = ('attachment; '
-                                           + 'filename="IngredientList.txt"')
+        renderer = request.accepted_renderer
+        content_type = renderer.media_type
+        if renderer.charset:
+            content_type += f'; charset={renderer.charset}'
+        response = StreamingHttpResponse(
+            EXPORT_FORMATS[renderer.format](get_shopping_list(request.user)),
+            content_type=content_type,
+        )
+        response['Content-Disposition'] = (
+            f'attachment; filename="IngredientList.{renderer.format}"')
         return response
@@ -15,3 +15,26 @@ MAX_COLOR_LENGTH = 7
 MAX_SLUG_LENGTH = 40
 MAX_UNIT_LENGTH = 30
 MAX_TEXT_LENGTH = 256
+MAX_BULK_RECIPES = 100
+MAX_JOB_TASK_LENGTH = 256
+JOB_MAX_ATTEMPTS = 5
+JOB_RETRY_DELAY = 10
+JOB_VISIBILITY_TIMEOUT = 300
+JOB_RETENTION_DAYS = 7
+JOB_PURGE_INTERVAL = 3600
+JOB_PURGE_BATCH_SIZE = 1000
+FEED_BACKFILL_SIZE = 100
+FEED_FANOUT_LIMIT = 10000
+FAVORITE_SCORE_WEIGHT = 1
+SHOPLIST_SCORE_WEIGHT = 2
+POPULARITY_HALF_LIFE_DAYS = 30
+TRENDING_HALF_LIFE_DAYS = 3
+RECIPE_ORDERINGS = {
+    'new': ('-pub_date', '-id'),
+    'popular': ('-popularity_score', '-id'),
+    'trending': ('-trending_score', '-id'),
+    'relevance': ('-search_rank', '-id'),
+}
+SEARCH_CONFIG = 'russian'
+SEARCH_NAME_WEIGHT = 1.0
+SEARCH_TEXT_WEIGHT = 0.4
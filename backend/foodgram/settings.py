@@ -1,6 +1,8 @@
 import os
+import sys
 from pathlib import Path
 
+from django.core.exceptions import ImproperlyConfigured
 from dotenv import load_dotenv
 
 
@@ -12,6 +14,9 @@ SECRET_KEY = os.getenv('SECRET_KEY', 'default')
 
 DEBUG = os.getenv('DEBUG', 'False') == 'True'
 
+TESTING = (sys.argv[1:2] == ['test']
+           or Path(sys.argv[0]).name in ('pytest', 'py.test'))
+
 ALLOWED_HOSTS = os.getenv('ALLOWED_HOSTS', '127.0.0.1').split()
 
 
@@ -27,6 +32,7 @@ INSTALLED_APPS = [
     'djoser',
     'django_filters',
     'api',
+    'jobs',
     'recipe',
     'user',
 ]
@@ -72,6 +78,25 @@ DATABASES = {
     }
 }
 
+# Версии данных для ETag, поколение и версии карточек рецептов меняют
+# и backend, и worker, и команды manage.py, поэтому кэш должен быть общим
+# для всех процессов. LocMemCache допустим только для DEBUG и тестов.
+LOCAL_CACHE_BACKEND = 'django.core.cache.backends.locmem.LocMemCache'
+
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv('CACHE_BACKEND', LOCAL_CACHE_BACKEND),
+        'LOCATION': os.getenv('CACHE_LOCATION', ''),
+    }
+}
+
+if (CACHES['default']['BACKEND'] == LOCAL_CACHE_BACKEND
+        and not (DEBUG or TESTING)):
+    raise ImproperlyConfigured(
+        'CACHE_BACKEND должен указывать на общий для процессов кэш, '
+        'например django.core.cache.backends.memcached.PyMemcacheCache'
+    )
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -129,3 +154,30 @@ REST_FRAMEWORK = {
 DJOSER = {
     'LOGIN_FIELD': 'email'
 }
+
+SHOPPING_LIST_PDF_FONT = os.getenv(
+    'SHOPPING_LIST_PDF_FONT',
+    '/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf',
+)
+
+QUERY_BUDGET_STRICT = os.getenv('QUERY_BUDGET_STRICT', 'False') == 'True'
+
+LOGGING = {
+    'version': 1,
+    'disable_existing_loggers': False,
+    'handlers': {
+        'console': {
+            'class': 'logging.StreamHandler',
+        },
+    },
+    'loggers': {
+        'api': {
+            'handlers': ['console'],
+            'level': os.getenv('API_LOG_LEVEL', 'INFO'),
+        },
+        'jobs': {
+            'handlers': ['console'],
+            'level': os.getenv('JOBS_LOG_LEVEL', 'INFO'),
+        },
+    },
+}
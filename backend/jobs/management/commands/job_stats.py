@@ -0,0 +1,43 @@
+import json
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from jobs.models import Job
+
+
+class Command(BaseCommand):
+    help = 'Глубина очереди задач и задержки выполнения.'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--minutes', type=int, default=60,
+                            help='За сколько минут считать задержки.')
+        parser.add_argument('--json', action='store_true',
+                            help='Вывести в JSON для систем мониторинга.')
+        parser.add_argument('--purge-older-than', type=int, metavar='DAYS',
+                            help='Сначала удалить завершенные задачи '
+                                 'старше DAYS дней.')
+
+    def handle(self, *args, **options):
+        if options['purge_older_than'] is not None:
+            deleted = Job.objects.purge(
+                timezone.now() - timedelta(days=options['purge_older_than']))
+            if not options['json']:
+                self.stdout.write(f'Удалено завершенных задач: {deleted}')
+        stats = Job.objects.stats(
+            timezone.now() - timedelta(minutes=options['minutes']))
+        if options['json']:
+            self.stdout.write(json.dumps(stats))
+            return
+        self.stdout.write(
+            'Задачи: ' + ', '.join(f'{status} {count}' for status, count
+                                   in stats['counts'].items()) + '\n'
+            f'Готовы к запуску: {stats["ready"]}, '
+            f'старейшая ждет {stats["oldest_ready_age"]:.1f} с\n'
+            f'Выполнено за {options["minutes"]} мин: {stats["done"]}\n'
+            f'Ожидание: среднее {stats["wait"]["avg"]:.2f} с, '
+            f'p95 {stats["wait"]["p95"]:.2f} с\n'
+            f'Выполнение: среднее {stats["run"]["avg"]:.2f} с, '
+            f'p95 {stats["run"]["p95"]:.2f} с'
+        )
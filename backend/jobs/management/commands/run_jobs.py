@@ -0,0 +1,100 @@
+import logging
+import signal
+import time
+import traceback
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from constants.constants import (JOB_PURGE_INTERVAL,
+                                 JOB_RETENTION_DAYS,
+                                 JOB_VISIBILITY_TIMEOUT)
+from jobs.models import Job
+
+
+logger = logging.getLogger('jobs')
+
+
+class Command(BaseCommand):
+    help = ('Выполняет задачи из очереди в пуле потоков. Задача может '
+            'быть выполнена повторно, если не уложилась в таймаут, '
+            'поэтому задачи должны быть идемпотентными.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=4,
+                            help='Число потоков.')
+        parser.add_argument('--poll-interval', type=float, default=1.0,
+                            help='Пауза между опросами пустой очереди, с.')
+        parser.add_argument('--visibility-timeout', type=int,
+                            default=JOB_VISIBILITY_TIMEOUT,
+                            help='Через сколько секунд незавершенная '
+                                 'задача выдается снова.')
+        parser.add_argument('--once', action='store_true',
+                            help='Выполнить готовые задачи и выйти.')
+        parser.add_argument('--purge-older-than', type=int,
+                            default=JOB_RETENTION_DAYS,
+                            help='Удалять завершенные задачи старше '
+                                 'стольких дней, 0 - не удалять.')
+
+    def handle(self, *args, **options):
+        self.stopping = False
+        signal.signal(signal.SIGTERM, self.stop)
+        signal.signal(signal.SIGINT, self.stop)
+        workers = options['workers']
+        running = set()
+        retention = options['purge_older_than']
+        purged_at = None
+        with ThreadPoolExecutor(max_workers=workers,
+                                thread_name_prefix='jobs') as pool:
+            while not self.stopping:
+                if retention and (purged_at is None or time.monotonic()
+                                  - purged_at >= JOB_PURGE_INTERVAL):
+                    purged_at = time.monotonic()
+                    self.purge(retention)
+                running = {future for future in running
+                           if not future.done()}
+                free = workers - len(running)
+                jobs = (Job.objects.claim(free,
+                                          options['visibility_timeout'])
+                        if free else [])
+                for job in jobs:
+                    running.add(pool.submit(self.run_job, job))
+                if jobs and len(running) < workers:
+                    continue
+                if options['once'] and not running:
+                    break
+                if running:
+                    wait(running, timeout=options['poll_interval'],
+                         return_when=FIRST_COMPLETED)
+                else:
+                    time.sleep(options['poll_interval'])
+        logger.info('Воркер остановлен')
+
+    def purge(self, days):
+        deleted = Job.objects.purge(timezone.now() - timedelta(days=days))
+        if deleted:
+            logger.info('Удалено завершенных задач: %s', deleted)
+
+    def stop(self, signum, frame):
+        logger.info('Получен сигнал %s, дожидаемся текущих задач', signum)
+        self.stopping = True
+
+    def run_job(self, job):
+        started = time.monotonic()
+        try:
+            if job.attempts > job.max_attempts:
+                job.fail('Превышено число попыток')
+                return
+            job.run()
+        except Exception:
+            logger.exception('Задача %s завершилась ошибкой', job)
+            job.fail(traceback.format_exc())
+        else:
+            job.complete()
+            logger.info('Задача %s выполнена за %.2f с',
+                        job, time.monotonic() - started)
+        finally:
+            close_old_connections()
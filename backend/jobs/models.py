@@ -0,0 +1,173 @@
+from datetime import timedelta
+
+from django.db import models, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from django.utils.module_loading import import_string
+
+from constants.constants import (JOB_MAX_ATTEMPTS,
+                                 JOB_PURGE_BATCH_SIZE,
+                                 JOB_RETRY_DELAY,
+                                 MAX_JOB_TASK_LENGTH)
+
+
+def summarize(values):
+    """Среднее и 95-й перцентиль в секундах."""
+    if not values:
+        return {'avg': 0, 'p95': 0}
+    values = sorted(values)
+    return {'avg': sum(values) / len(values),
+            'p95': values[min(len(values) - 1, int(len(values) * 0.95))]}
+
+
+class JobManager(models.Manager):
+
+    def enqueue(self, task, *args, run_at=None):
+        """Ставит задачу в очередь в текущей транзакции.
+
+        Воркер увидит задачу только после фиксации транзакции, при
+        откате она пропадет вместе с остальными изменениями.
+        """
+        return self.create(task=task, args=list(args),
+                           run_at=run_at or timezone.now())
+
+    def claim(self, limit, visibility_timeout):
+        """Забирает до limit готовых задач для выполнения.
+
+        Строки блокируются через SELECT ... FOR UPDATE SKIP LOCKED, так
+        что несколько воркеров не получат одну задачу. Задачи, чей
+        воркер не отчитался за visibility_timeout секунд, выдаются снова.
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            ids = list(
+                self.select_for_update(skip_locked=True)
+                .filter(Q(status=Job.QUEUED, run_at__lte=now)
+                        | Q(status=Job.RUNNING, locked_until__lt=now))
+                .order_by('run_at')
+                .values_list('id', flat=True)[:limit]
+            )
+            self.filter(id__in=ids).update(
+                status=Job.RUNNING,
+                attempts=F('attempts') + 1,
+                started=now,
+                locked_until=now + timedelta(seconds=visibility_timeout),
+            )
+        return list(self.filter(id__in=ids).order_by('run_at'))
+
+    def purge(self, before, batch_size=JOB_PURGE_BATCH_SIZE):
+        """Удаляет выполненные и упавшие задачи, завершенные до before.
+
+        Удаление идет пачками по batch_size строк, чтобы не держать
+        долгую транзакцию. Возвращает число удаленных задач.
+        """
+        finished = self.filter(status__in=(Job.DONE, Job.FAILED),
+                               finished__lt=before)
+        deleted = 0
+        while True:
+            ids = list(finished.values_list('id', flat=True)[:batch_size])
+            if not ids:
+                return deleted
+            deleted += self.filter(id__in=ids).delete()[0]
+
+    def stats(self, since):
+        """Глубина очереди и задержки задач, завершенных после since."""
+        now = timezone.now()
+        counts = dict(self.values_list('status')
+                      .annotate(count=models.Count('id'))
+                      .order_by())
+        oldest = (self.filter(status=Job.QUEUED, run_at__lte=now)
+                  .aggregate(oldest=models.Min('run_at'))['oldest'])
+        timings = self.filter(status=Job.DONE, finished__gte=since)
+        waits, runs = [], []
+        for run_at, started, finished in timings.values_list(
+                'run_at', 'started', 'finished'):
+            waits.append((started - run_at).total_seconds())
+            runs.append((finished - started).total_seconds())
+        return {
+            'counts': {status: counts.get(status, 0)
+                       for status, _ in Job.STATUSES},
+            'ready': self.filter(status=Job.QUEUED, run_at__lte=now).count(),
+            'oldest_ready_age': ((now - oldest).total_seconds()
+                                 if oldest else 0),
+            'done': len(runs),
+            'wait': summarize(waits),
+            'run': summarize(runs),
+        }
+
+
+class Job(models.Model):
+    """Отложенная задача: путь к функции и ее аргументы."""
+
+    QUEUED = 'queued'
+    RUNNING = 'running'
+    DONE = 'done'
+    FAILED = 'failed'
+    STATUSES = (
+        (QUEUED, 'В очереди'),
+        (RUNNING, 'Выполняется'),
+        (DONE, 'Выполнена'),
+        (FAILED, 'Ошибка'),
+    )
+
+    task = models.CharField(verbose_name='Задача',
+                            max_length=MAX_JOB_TASK_LENGTH)
+    args = models.JSONField(verbose_name='Аргументы', default=list)
+    status = models.CharField(verbose_name='Статус',
+                              max_length=max(len(key) for key, _ in STATUSES),
+                              choices=STATUSES,
+                              default=QUEUED)
+    attempts = models.PositiveSmallIntegerField(verbose_name='Попытки',
+                                                default=0)
+    max_attempts = models.PositiveSmallIntegerField(
+        verbose_name='Максимум попыток', default=JOB_MAX_ATTEMPTS)
+    run_at = models.DateTimeField(verbose_name='Запустить после',
+                                  default=timezone.now)
+    locked_until = models.DateTimeField(verbose_name='Занята до',
+                                        null=True, blank=True)
+    created = models.DateTimeField(verbose_name='Создана',
+                                   auto_now_add=True)
+    started = models.DateTimeField(verbose_name='Запущена',
+                                   null=True, blank=True)
+    finished = models.DateTimeField(verbose_name='Завершена',
+                                    null=True, blank=True)
+    last_error = models.TextField(verbose_name='Последняя ошибка',
+                                  blank=True)
+
+    objects = JobManager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['status', 'run_at'],
+                         name='job_status_run_at'),
+            models.Index(fields=['status', 'finished'],
+                         name='job_status_finished'),
+        ]
+        verbose_name = 'Задача'
+        verbose_name_plural = 'Задачи'
+
+    def __str__(self) -> str:
+        return f'{self.task}{tuple(self.args)} - {self.status}'
+
+    def run(self):
+        import_string(self.task)(*self.args)
+
+    def owned(self):
+        """Строка задачи, если ее не выдали другому воркеру по таймауту."""
+        return Job.objects.filter(id=self.id, attempts=self.attempts)
+
+    def complete(self):
+        self.owned().update(status=Job.DONE,
+                            finished=timezone.now(),
+                            locked_until=None)
+
+    def fail(self, error):
+        """Возвращает задачу в очередь с растущей паузой или закрывает."""
+        now = timezone.now()
+        if self.attempts >= self.max_attempts:
+            changes = {'status': Job.FAILED, 'finished': now}
+        else:
+            delay = JOB_RETRY_DELAY * 2 ** (self.attempts - 1)
+            changes = {'status': Job.QUEUED,
+                       'run_at': now + timedelta(seconds=delay)}
+        self.owned().update(locked_until=None, last_error=error, **changes)
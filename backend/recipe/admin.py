@@ -1,10 +1,12 @@
 from django.contrib import admin
 
 from .models import (Favorite,
+                     FeedEntry,
                      Ingredient,
                      Recipe,
                      RecipeToIngredient,
                      ShopList,
+                     ShopListIngredient,
                      Tag)
 
 
@@ -36,3 +38,13 @@ class Favorite(admin.ModelAdmin):
 @admin.register(ShopList)
 class ShopList(admin.ModelAdmin):
     pass
+
+
+@admin.register(ShopListIngredient)
+class ShopListIngredientAdmin(admin.ModelAdmin):
+    list_display = ('user', 'ingredient', 'amount')
+
+
+@admin.register(FeedEntry)
+class FeedEntryAdmin(admin.ModelAdmin):
+    list_display = ('user', 'recipe', 'pub_date')
@@ -0,0 +1,17 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipe.models import FeedEntry
+from user.models import Subscribe
+
+
+class Command(BaseCommand):
+    help = ('Заполняет ленты подписчиков последними рецептами '
+            'авторов из подписок.')
+
+    def handle(self, *args, **options):
+        subscriptions = Subscribe.objects.values_list('user_id', 'author_id')
+        for user_id, author_id in subscriptions.iterator():
+            with transaction.atomic():
+                FeedEntry.objects.backfill(user_id, author_id)
+        self.stdout.write(f'Записей в лентах: {FeedEntry.objects.count()}')
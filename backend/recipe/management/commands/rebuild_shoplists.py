@@ -0,0 +1,43 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from recipe.models import ShopListIngredient
+
+
+class Command(BaseCommand):
+    help = ('Пересчитывает суммы ингредиентов в списках покупок '
+            'и сообщает о расхождениях.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только сообщить о расхождениях.')
+
+    def handle(self, *args, **options):
+        with transaction.atomic():
+            expected = {(user_id, ingredient_id): total
+                        for user_id, ingredient_id, total
+                        in ShopListIngredient.objects.calculate()}
+            stored = {(user_id, ingredient_id): amount
+                      for user_id, ingredient_id, amount
+                      in ShopListIngredient.objects.values_list(
+                          'user_id', 'ingredient_id', 'amount')}
+            missing = expected.keys() - stored.keys()
+            extra = stored.keys() - expected.keys()
+            wrong = [key for key in expected.keys() & stored.keys()
+                     if expected[key] != stored[key]]
+            self.stdout.write(f'Строк ожидается: {len(expected)}, '
+                              f'хранится: {len(stored)}\n'
+                              f'Отсутствуют: {len(missing)}\n'
+                              f'Лишние: {len(extra)}\n'
+                              f'С неверной суммой: {len(wrong)}')
+            if options['dry_run']:
+                return
+            ShopListIngredient.objects.all().delete()
+            ShopListIngredient.objects.bulk_create(
+                (ShopListIngredient(user_id=user_id,
+                                    ingredient_id=ingredient_id,
+                                    amount=total)
+                 for (user_id, ingredient_id), total in expected.items()),
+                batch_size=1000,
+            )
+        self.stdout.write(self.style.SUCCESS('Списки покупок пересчитаны'))
@@ -0,0 +1,66 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.db.models import Count
+
+from recipe.models import Favorite, Recipe, ShopList
+from user.models import Subscribe, User
+
+
+COUNTERS = {
+    Recipe: (('favorites_count', Favorite, 'recipe_id'),
+             ('shopping_cart_count', ShopList, 'recipe_id')),
+    User: (('recipes_count', Recipe, 'author_id'),
+           ('followers_count', Subscribe, 'author_id'),
+           ('following_count', Subscribe, 'user_id')),
+}
+
+
+class Command(BaseCommand):
+    help = ('Сверяет счетчики рецептов и пользователей с таблицами '
+            'и исправляет расхождения пачками.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=1000,
+                            help='Сколько строк сверять за транзакцию.')
+        parser.add_argument('--dry-run', action='store_true',
+                            help='Только сообщить о расхождениях.')
+
+    def handle(self, *args, **options):
+        for model, counters in COUNTERS.items():
+            drift = dict.fromkeys((field for field, _, _ in counters), 0)
+            last_id = 0
+            while True:
+                with transaction.atomic():
+                    batch = list(
+                        model.objects.select_for_update()
+                        .filter(id__gt=last_id)
+                        .order_by('id')
+                        .only('id', *drift)[:options['batch_size']]
+                    )
+                    if not batch:
+                        break
+                    last_id = batch[-1].id
+                    changed = self.reconcile(batch, counters, drift)
+                    if changed and not options['dry_run']:
+                        model.objects.bulk_update(changed, list(drift))
+            for field, count in drift.items():
+                self.stdout.write(f'{model.__name__}.{field}: '
+                                  f'расхождений {count}')
+
+    def reconcile(self, batch, counters, drift):
+        """Пересчитывает счетчики пачки, возвращает измененные объекты."""
+        ids = [obj.id for obj in batch]
+        changed = set()
+        for field, source, key in counters:
+            actual = dict(source.objects
+                          .filter(**{f'{key}__in': ids})
+                          .values_list(key)
+                          .annotate(count=Count('id'))
+                          .order_by())
+            for obj in batch:
+                value = actual.get(obj.id, 0)
+                if getattr(obj, field) != value:
+                    setattr(obj, field, value)
+                    drift[field] += 1
+                    changed.add(obj)
+        return list(changed)
@@ -0,0 +1,23 @@
+# Generated by Django 3.2 on 2026-10-18 01:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0006_shoplistingredient'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_card',
+            field=models.ImageField(blank=True, upload_to='recipes/card/', verbose_name='Миниатюра для карточки'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='image_detail',
+            field=models.ImageField(blank=True, upload_to='recipes/detail/', verbose_name='Изображение для страницы'),
+        ),
+    ]
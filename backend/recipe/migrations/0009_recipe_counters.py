@@ -0,0 +1,49 @@
+# Generated by Django 3.2 on 2026-10-18 02:02
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def count(model, key):
+    return Coalesce(Subquery(
+        model.objects.filter(**{key: OuterRef('pk')})
+        .values(key)
+        .annotate(count=Count('pk'))
+        .values('count')
+    ), 0)
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipe', 'Recipe')
+    Favorite = apps.get_model('recipe', 'Favorite')
+    ShopList = apps.get_model('recipe', 'ShopList')
+    User = apps.get_model('user', 'User')
+    Subscribe = apps.get_model('user', 'Subscribe')
+    Recipe.objects.update(favorites_count=count(Favorite, 'recipe'),
+                          shopping_cart_count=count(ShopList, 'recipe'))
+    User.objects.update(recipes_count=count(Recipe, 'author'),
+                        followers_count=count(Subscribe, 'author'),
+                        following_count=count(Subscribe, 'user'))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0008_feedentry'),
+        ('user', '0003_user_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В избранном'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_cart_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='В списках покупок'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
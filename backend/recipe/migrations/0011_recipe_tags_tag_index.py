@@ -0,0 +1,22 @@
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    """Индекс (tag_id, recipe_id) для фильтра рецептов по тэгам.
+
+    Промежуточная таблица тэгов создается Django автоматически,
+    поэтому индекс добавляется SQL. Поиск по (recipe_id, tag_id)
+    покрывает уникальный индекс таблицы.
+    """
+
+    dependencies = [
+        ('recipe', '0010_recipe_scores'),
+    ]
+
+    operations = [
+        migrations.RunSQL(
+            'CREATE INDEX recipe_tags_tag_recipe '
+            'ON recipe_recipe_tags (tag_id, recipe_id);',
+            'DROP INDEX recipe_tags_tag_recipe;',
+        ),
+    ]
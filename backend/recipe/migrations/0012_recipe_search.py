@@ -0,0 +1,62 @@
+# Generated by Django 3.2 on 2026-10-18 02:15
+
+import django.contrib.postgres.search
+from django.db import migrations
+
+
+SEARCH_VECTOR = (
+    "setweight(to_tsvector('russian', coalesce({row}name, '')), 'A') || "
+    "setweight(to_tsvector('russian', coalesce({row}text, '')), 'B')"
+)
+
+FORWARD = [
+    f'''
+    CREATE FUNCTION recipe_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector := {SEARCH_VECTOR.format(row='NEW.')};
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql;
+    ''',
+    'CREATE TRIGGER recipe_search_vector_update '
+    'BEFORE INSERT OR UPDATE OF name, text ON recipe_recipe '
+    'FOR EACH ROW EXECUTE PROCEDURE recipe_search_vector_update();',
+    f'UPDATE recipe_recipe SET search_vector = {SEARCH_VECTOR.format(row="")};',
+    'CREATE INDEX recipe_search_vector ON recipe_recipe '
+    'USING gin (search_vector);',
+]
+
+BACKWARD = [
+    'DROP INDEX recipe_search_vector;',
+    'DROP TRIGGER recipe_search_vector_update ON recipe_recipe;',
+    'DROP FUNCTION recipe_search_vector_update();',
+]
+
+
+def run_on_postgresql(statements):
+    """Триггер и GIN-индекс есть только в PostgreSQL.
+
+    На SQLite поле остается пустым, поиск идет по name и text.
+    """
+    def run(apps, schema_editor):
+        if schema_editor.connection.vendor == 'postgresql':
+            for statement in statements:
+                schema_editor.execute(statement)
+    return run
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipe', '0011_recipe_tags_tag_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='search_vector',
+            field=django.contrib.postgres.search.SearchVectorField(editable=False, null=True, verbose_name='Поисковый вектор'),
+        ),
+        migrations.RunPython(run_on_postgresql(FORWARD),
+                             run_on_postgresql(BACKWARD)),
+    ]
@@ -1,9 +1,13 @@
+from django.contrib.postgres.search import SearchVectorField
 from django.core.validators import (validate_slug,
                                     MaxValueValidator,
                                     MinValueValidator)
-from django.db import models
+from django.db import connection, models
+from django.db.models.functions import Coalesce
+from django.utils import timezone
 
-from constants.constants import (MAX_AMOUNT_VALUE,
+from constants.constants import (FEED_BACKFILL_SIZE,
+                                 MAX_AMOUNT_VALUE,
                                  MAX_COLOR_LENGTH,
                                  MAX_COOK_TIME_VALUE,
                                  MAX_INGREDIENT_NAME_LENGTH,
@@ -14,7 +18,7 @@ from constants.constants import (MAX_AMOUNT_VALUE,
                                  MAX_UNIT_LENGTH,
                                  MIN_AMOUNT_VALUE,
                                  MIN_COOK_TIME_VALUE)
-from user.models import User
+from user.models import CountersMixin, Subscribe, User
 
 from .validators import validate_color
 
@@ -68,7 +72,7 @@ class Ingredient(models.Model):
         return f'{self.name} {self.measurement_unit}'
 
 
-class Recipe(models.Model):
+class Recipe(CountersMixin, models.Model):
     """Модель рецептов."""
 
     author = models.ForeignKey(User,
@@ -81,6 +85,12 @@ class Recipe(models.Model):
     image = models.ImageField(upload_to='recipes/',
                               blank=False,
                               verbose_name='Image')
+    image_card = models.ImageField(upload_to='recipes/card/',
+                                   blank=True,
+                                   verbose_name='Миниатюра для карточки')
+    image_detail = models.ImageField(upload_to='recipes/detail/',
+                                     blank=True,
+                                     verbose_name='Изображение для страницы')
     text = models.CharField(max_length=MAX_RECIPE_TEXT_LENGTH,
                             blank=False,
                             verbose_name='Text')
@@ -96,12 +106,35 @@ class Recipe(models.Model):
     ingredients = models.ManyToManyField(Ingredient,
                                          blank=False,
                                          related_name='recipes')
+    favorites_count = models.PositiveIntegerField(verbose_name='В избранном',
+                                                  default=0)
+    shopping_cart_count = models.PositiveIntegerField(
+        verbose_name='В списках покупок', default=0)
+    popularity_score = models.FloatField(verbose_name='Популярность',
+                                         default=0)
+    trending_score = models.FloatField(verbose_name='Набирает популярность',
+                                       default=0)
+    search_vector = SearchVectorField(verbose_name='Поисковый вектор',
+                                      null=True,
+                                      editable=False)
+
+    counter_fields = ('favorites_count', 'shopping_cart_count',
+                      'popularity_score', 'trending_score')
+    worker_fields = ('image_card', 'image_detail')
 
     def __str__(self) -> str:
         return f'{self.name} - {self.author}'
 
     class Meta:
         ordering = ('-pub_date',)
+        indexes = [
+            models.Index(fields=['author', '-pub_date', '-id'],
+                         name='recipe_author_pub_date'),
+            models.Index(fields=['-popularity_score', '-id'],
+                         name='recipe_popularity'),
+            models.Index(fields=['-trending_score', '-id'],
+                         name='recipe_trending'),
+        ]
         verbose_name = 'Рецепт',
         verbose_name_plural = 'Рецепты'
 
@@ -134,6 +167,58 @@ class RecipeToIngredient(models.Model):
         verbose_name_plural = 'Ингредиенты в рецептах'
 
 
+def placeholders(values):
+    return ', '.join(['%s'] * len(values))
+
+
+class UserRecipeListManager(models.Manager):
+    """Запись пар пользователь-рецепт одним запросом."""
+
+    def add_many(self, user_id, recipe_ids):
+        """Добавляет существующие рецепты, возвращает id добавленных."""
+        if not recipe_ids:
+            return set()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(self.model._meta.db_table)} '
+                f'(user_id, recipe_id, created) '
+                f'SELECT %s, id, %s FROM {quote(Recipe._meta.db_table)} '
+                f'WHERE id IN ({placeholders(recipe_ids)}) '
+                f'ON CONFLICT (user_id, recipe_id) DO NOTHING '
+                f'RETURNING recipe_id',
+                [user_id, timezone.now(), *recipe_ids],
+            )
+            added = {recipe_id for recipe_id, in cursor.fetchall()}
+        self.update_counters(added, 1)
+        return added
+
+    def remove_many(self, user_id, recipe_ids):
+        """Удаляет рецепты из списка, возвращает id удаленных."""
+        if not recipe_ids:
+            return set()
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM {quote(self.model._meta.db_table)} '
+                f'WHERE user_id = %s '
+                f'AND recipe_id IN ({placeholders(recipe_ids)}) '
+                f'RETURNING recipe_id',
+                [user_id, *recipe_ids],
+            )
+            removed = {recipe_id for recipe_id, in cursor.fetchall()}
+        self.update_counters(removed, -1)
+        return removed
+
+    def update_counters(self, recipe_ids, delta):
+        """Меняет счетчик списка у рецептов на delta."""
+        if not recipe_ids:
+            return
+        field = self.model.counter_field
+        Recipe.objects.filter(id__in=recipe_ids).update(
+            **{field: models.F(field) + delta})
+
+
 class AbstractUserRecipeList(models.Model):
     """Абстракция для Favorite и ShopList."""
 
@@ -141,6 +226,12 @@ class AbstractUserRecipeList(models.Model):
                              on_delete=models.CASCADE)
     recipe = models.ForeignKey(Recipe,
                                on_delete=models.CASCADE)
+    created = models.DateTimeField(verbose_name='Добавлено',
+                                   default=timezone.now,
+                                   db_index=True)
+
+    objects = UserRecipeListManager()
+    counter_field = None
 
     class Meta:
         abstract = True
@@ -149,6 +240,8 @@ class AbstractUserRecipeList(models.Model):
 class Favorite(AbstractUserRecipeList):
     """Модель избранного."""
 
+    counter_field = 'favorites_count'
+
     class Meta(AbstractUserRecipeList.Meta):
         default_related_name = 'recipe_favorite'
         verbose_name = 'Избранное',
@@ -164,6 +257,8 @@ class Favorite(AbstractUserRecipeList):
 class ShopList(AbstractUserRecipeList):
     """Модель списка покупок."""
 
+    counter_field = 'shopping_cart_count'
+
     class Meta(AbstractUserRecipeList.Meta):
         default_related_name = 'shoplist'
         verbose_name = 'Список покупок'
@@ -177,3 +272,218 @@ class ShopList(AbstractUserRecipeList):
 
     def __str__(self) -> str:
         return f'{self.user} shoplist'
+
+
+class ShopListIngredientManager(models.Manager):
+    """Инкрементальное обновление сумм ингредиентов в корзинах."""
+
+    def add_recipes(self, recipe_ids, user_id=None):
+        """Прибавляет ингредиенты рецептов к корзине user_id.
+
+        Без user_id - ко всем корзинам, где лежат рецепты.
+        """
+        if not recipe_ids:
+            return
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        lines = quote(RecipeToIngredient._meta.db_table)
+        if user_id is None:
+            select = (f'SELECT cart.user_id, line.ingredient_id, '
+                      f'SUM(line.amount) FROM {lines} AS line '
+                      f'JOIN {quote(ShopList._meta.db_table)} AS cart '
+                      f'ON cart.recipe_id = line.recipe_id '
+                      f'WHERE line.recipe_id IN ({placeholders(recipe_ids)}) '
+                      f'GROUP BY cart.user_id, line.ingredient_id')
+            params = list(recipe_ids)
+        else:
+            select = (f'SELECT %s, line.ingredient_id, SUM(line.amount) '
+                      f'FROM {lines} AS line '
+                      f'WHERE line.recipe_id IN ({placeholders(recipe_ids)}) '
+                      f'GROUP BY line.ingredient_id')
+            params = [user_id, *recipe_ids]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'{select} '
+                f'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                f'SET amount = {table}.amount + EXCLUDED.amount',
+                params,
+            )
+
+    def remove_recipes(self, recipe_ids, user_id=None):
+        """Вычитает ингредиенты рецептов из корзины user_id.
+
+        Без user_id - из всех корзин, где лежат рецепты.
+        """
+        if not recipe_ids:
+            return
+        lines = RecipeToIngredient.objects.filter(recipe_id__in=recipe_ids)
+        subtracted = lines.filter(ingredient=models.OuterRef('ingredient_id'))
+        if user_id is None:
+            totals = self.filter(user__in=ShopList.objects
+                                 .filter(recipe_id__in=recipe_ids)
+                                 .values('user_id'))
+            subtracted = subtracted.filter(
+                recipe__shoplist__user=models.OuterRef('user_id'))
+        else:
+            totals = self.filter(user_id=user_id)
+        totals = totals.filter(ingredient__in=lines.values('ingredient_id'))
+        totals.update(amount=models.F('amount') - Coalesce(
+            models.Subquery(subtracted
+                            .values('ingredient')
+                            .annotate(total=models.Sum('amount'))
+                            .values('total')),
+            0,
+        ))
+        totals.filter(amount__lte=0).delete()
+
+    def recalculate(self, ingredient_ids, user_id=None, recipe_id=None):
+        """Считает заново суммы ингредиентов в корзинах.
+
+        Корзины - корзина user_id или все корзины с рецептом recipe_id.
+        Результат не зависит от прежних сумм, поэтому повторный вызов,
+        например при каскадном удалении, ничего не искажает. Нужен для
+        изменений через ORM, запросы API меняют суммы на разницу.
+        """
+        ingredient_ids = list(ingredient_ids)
+        if not ingredient_ids:
+            return
+        quote = connection.ops.quote_name
+        table = quote(self.model._meta.db_table)
+        carts = quote(ShopList._meta.db_table)
+        if user_id is None:
+            users = self.filter(user__in=ShopList.objects
+                                .filter(recipe_id=recipe_id)
+                                .values('user_id'))
+            condition = (f'cart.user_id IN (SELECT user_id FROM {carts} '
+                         f'WHERE recipe_id = %s)')
+            params = [recipe_id]
+        else:
+            users = self.filter(user_id=user_id)
+            condition = 'cart.user_id = %s'
+            params = [user_id]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {table} (user_id, ingredient_id, amount) '
+                f'SELECT cart.user_id, line.ingredient_id, SUM(line.amount) '
+                f'FROM {quote(RecipeToIngredient._meta.db_table)} AS line '
+                f'JOIN {carts} AS cart ON cart.recipe_id = line.recipe_id '
+                f'WHERE {condition} '
+                f'AND line.ingredient_id IN ({placeholders(ingredient_ids)}) '
+                f'GROUP BY cart.user_id, line.ingredient_id '
+                f'ON CONFLICT (user_id, ingredient_id) DO UPDATE '
+                f'SET amount = EXCLUDED.amount',
+                [*params, *ingredient_ids],
+            )
+        users.filter(ingredient_id__in=ingredient_ids).filter(
+            ~models.Exists(RecipeToIngredient.objects.filter(
+                ingredient=models.OuterRef('ingredient_id'),
+                recipe__shoplist__user=models.OuterRef('user_id'),
+            ))
+        ).delete()
+
+    def calculate(self):
+        """Суммы, посчитанные заново по спискам покупок."""
+        return (RecipeToIngredient.objects
+                .filter(recipe__shoplist__isnull=False)
+                .values_list('recipe__shoplist__user_id', 'ingredient_id')
+                .annotate(total=models.Sum('amount'))
+                .order_by())
+
+
+class ShopListIngredient(models.Model):
+    """Сумма ингредиента по всем рецептам в списке покупок."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='shoplist_ingredients')
+    ingredient = models.ForeignKey(Ingredient, on_delete=models.CASCADE,
+                                   related_name='shoplist_totals')
+    amount = models.IntegerField(verbose_name='amount', default=0)
+
+    objects = ShopListIngredientManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'ingredient'],
+                name='user_ingredient_shoplist'
+            ),
+        ]
+        verbose_name = 'Ингредиент в списке покупок'
+        verbose_name_plural = 'Ингредиенты в списках покупок'
+
+    def __str__(self) -> str:
+        return f'{self.ingredient} {self.amount}'
+
+
+class FeedEntryManager(models.Manager):
+    """Заполнение лент подписчиков одним запросом."""
+
+    def fan_out(self, recipe_id):
+        """Добавляет рецепт в ленты всех подписчиков автора."""
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(self.model._meta.db_table)} '
+                f'(user_id, recipe_id, author_id, pub_date) '
+                f'SELECT sub.user_id, recipe.id, recipe.author_id, '
+                f'recipe.pub_date '
+                f'FROM {quote(Recipe._meta.db_table)} AS recipe '
+                f'JOIN {quote(Subscribe._meta.db_table)} AS sub '
+                f'ON sub.author_id = recipe.author_id '
+                f'WHERE recipe.id = %s '
+                f'ON CONFLICT (user_id, recipe_id) DO NOTHING',
+                [recipe_id],
+            )
+            return cursor.rowcount
+
+    def backfill(self, user_id, author_id):
+        """Добавляет в ленту последние рецепты нового автора."""
+        quote = connection.ops.quote_name
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO {quote(self.model._meta.db_table)} '
+                f'(user_id, recipe_id, author_id, pub_date) '
+                f'SELECT %s, latest.id, latest.author_id, latest.pub_date '
+                f'FROM (SELECT id, author_id, pub_date '
+                f'FROM {quote(Recipe._meta.db_table)} '
+                f'WHERE author_id = %s '
+                f'ORDER BY pub_date DESC, id DESC LIMIT %s) AS latest '
+                f'WHERE true '
+                f'ON CONFLICT (user_id, recipe_id) DO NOTHING',
+                [user_id, author_id, FEED_BACKFILL_SIZE],
+            )
+
+    def prune(self, user_id, author_id):
+        """Убирает из ленты рецепты автора после отписки."""
+        self.filter(user_id=user_id, author_id=author_id).delete()
+
+
+class FeedEntry(models.Model):
+    """Рецепт в ленте подписчика, заполняется при публикации."""
+
+    user = models.ForeignKey(User, on_delete=models.CASCADE,
+                             related_name='feed_entries')
+    recipe = models.ForeignKey(Recipe, on_delete=models.CASCADE,
+                               related_name='feed_entries')
+    author = models.ForeignKey(User, on_delete=models.CASCADE,
+                               related_name='+')
+    pub_date = models.DateTimeField('pub_date')
+
+    objects = FeedEntryManager()
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(
+                fields=['user', 'recipe'],
+                name='user_recipe_feed'
+            ),
+        ]
+        indexes = [
+            models.Index(fields=['user', '-pub_date', '-recipe'],
+                         name='feed_user_pub_date'),
+            models.Index(fields=['user', 'author'],
+                         name='feed_user_author'),
+        ]
+        verbose_name = 'Запись ленты'
+        verbose_name_plural = 'Записи лент'
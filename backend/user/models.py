@@ -1,4 +1,4 @@
-from django.db import models
+from django.db import connection, models
 from django.contrib.auth.models import AbstractUser
 from django.contrib.auth.validators import UnicodeUsernameValidator
 
@@ -10,7 +10,32 @@ from constants.constants import (MAX_EMAIL_LENGTH,
 from .validators import validate_me
 
 
-class User(AbstractUser):
+class CountersMixin:
+    """Поля, которые меняются только через update().
+
+    counter_fields - счетчики и рейтинги, worker_fields - поля,
+    которые заполняют фоновые задачи. При сохранении существующего
+    объекта эти поля и отложенные поля не записываются, чтобы
+    устаревшие значения из памяти не затерли параллельные изменения.
+    """
+
+    counter_fields = ()
+    worker_fields = ()
+
+    def save(self, *args, **kwargs):
+        if not self._state.adding and kwargs.get('update_fields') is None:
+            excluded = {*self.counter_fields, *self.worker_fields}
+            deferred = self.get_deferred_fields()
+            kwargs['update_fields'] = [
+                field.name for field in self._meta.concrete_fields
+                if not field.primary_key
+                and field.name not in excluded
+                and field.attname not in deferred
+            ]
+        super().save(*args, **kwargs)
+
+
+class User(CountersMixin, AbstractUser):
     """Модель юзера."""
 
     USERNAME_FIELD = 'email'
@@ -28,6 +53,14 @@ class User(AbstractUser):
     first_name = models.CharField(max_length=MAX_FIRST_NAME_LENGTH)
 
     last_name = models.CharField(max_length=MAX_LAST_NAME_LENGTH)
+    recipes_count = models.PositiveIntegerField(verbose_name='Рецептов',
+                                                default=0)
+    followers_count = models.PositiveIntegerField(verbose_name='Подписчиков',
+                                                  default=0)
+    following_count = models.PositiveIntegerField(verbose_name='Подписок',
+                                                  default=0)
+
+    counter_fields = ('recipes_count', 'followers_count', 'following_count')
 
     class Meta:
         verbose_name = 'Пользователь',
@@ -37,6 +70,46 @@ class User(AbstractUser):
         return f'{self.username}'
 
 
+class SubscribeManager(models.Manager):
+    """Подписка и отписка одним запросом."""
+
+    def subscribe(self, user_id, author_id):
+        """Создает подписку, False - если она уже есть."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'INSERT INTO '
+                f'{connection.ops.quote_name(self.model._meta.db_table)} '
+                f'(user_id, author_id) VALUES (%s, %s) '
+                f'ON CONFLICT (author_id, user_id) DO NOTHING '
+                f'RETURNING id',
+                [user_id, author_id],
+            )
+            created = cursor.fetchone() is not None
+        if created:
+            self.update_counters(user_id, author_id, 1)
+        return created
+
+    def unsubscribe(self, user_id, author_id):
+        """Удаляет подписку, False - если ее не было."""
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f'DELETE FROM '
+                f'{connection.ops.quote_name(self.model._meta.db_table)} '
+                f'WHERE user_id = %s AND author_id = %s',
+                [user_id, author_id],
+            )
+            deleted = cursor.rowcount > 0
+        if deleted:
+            self.update_counters(user_id, author_id, -1)
+        return deleted
+
+    def update_counters(self, user_id, author_id, delta):
+        User.objects.filter(id=user_id).update(
+            following_count=models.F('following_count') + delta)
+        User.objects.filter(id=author_id).update(
+            followers_count=models.F('followers_count') + delta)
+
+
 class Subscribe(models.Model):
     """Модель подписок."""
 
@@ -45,6 +118,8 @@ class Subscribe(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE,
                                related_name='author')
 
+    objects = SubscribeManager()
+
     def __str__(self) -> str:
         return f'{self.user.username}'
 